@@ -1,25 +1,32 @@
 #!/usr/bin/env python3
 
+import time
+
+# Before the other imports, so that the startup time includes them
+STARTED: float = time.perf_counter()
+
 import argparse
-import livereload
-import multiprocessing
 import os
-import platform
 import shutil
 import sys
-import threading
-import tkinter as tk
-import yaml
 
-from typing import Any, Dict, List, TextIO
+from typing import TYPE_CHECKING, Any, Dict, List, Optional, TextIO
 
-from reveal_cli import watch_for_changes
-from reveal_gui import Gui
 from version import __version__
 
+# The modules of the commands, the GUI (tkinter), the server (livereload and
+# tornado) and the watcher (watchdog) take hundreds of milliseconds to
+# import, so each command imports what it needs when it runs
+if TYPE_CHECKING:
+    from reveal_images import ImagePipeline
+
 
 NAME: str = "reveal launcher"
 
+# Seconds that "reveal.py -v" may take, without the startup of Python
+# itself. "-d" prints how long startup took.
+STARTUP_BUDGET: float = 0.1
+
 CONFIG_FILE_NAME: str = "config.yaml"
 
 # Directory of _this_ script
@@ -28,12 +35,18 @@ BASE_DIRECTORY: str = os.path.dirname(os.path.realpath(__file__))
 
 def cli_args() -> argparse.Namespace:
     parser: argparse.ArgumentParser = argparse.ArgumentParser(
-        description="Launch a reveal.js presentation")
-    parser.add_argument("folder",
-                        nargs='?',
-                        default=os.getcwd(),  # Current directory
+        description="Launch a reveal.js presentation",
+        epilog="Run \"%(prog)s build -h\" to build a presentation into a "
+        "static site, \"%(prog)s export -h\" to export it to a single "
+        "HTML file, or \"%(prog)s export-pdf -h\" to print it to PDF "
+        "instead")
+    parser.add_argument("folders",
+                        nargs='*',
+                        default=[os.getcwd()],  # Current directory
+                        metavar="folder",
                         help="where to serve the presentation from, defaults "
-                        "to current directory")
+                        "to current directory. Several folders are served "
+                        "side by side, each under /<folder name>/")
     parser.add_argument("-p", "--port",
                         type=int,
                         default=8000,
@@ -49,12 +62,108 @@ def cli_args() -> argparse.Namespace:
     #parser.add_argument("--plugins",
     #                    action="store_true",
     #                    help="list available plugins and exit")
+    parser.add_argument("-d", "--debug",
+                        action="store_true",
+                        help="print debug messages")
+    parser.add_argument("--timings", "--profile",
+                        action="store_true",
+                        help="print how long loading the configuration, "
+                        "starting the watcher and server and each stage of "
+                        "every refresh take")
+    parser.add_argument("--trace",
+                        metavar="FILE",
+                        help="also append the timings to FILE, one JSON "
+                        "object per line, implies --timings")
     parser.add_argument("-v", "--version",
                         action="store_true",
                         help="print %(prog)s version and exit")
     return parser.parse_args()
 
 
+def build_args(argv: List[str]) -> argparse.Namespace:
+    parser: argparse.ArgumentParser = argparse.ArgumentParser(
+        prog=os.path.basename(sys.argv[0]) + " build",
+        description="Build a reveal.js presentation into a static site, with "
+        "only the reveal.js files it needs, minified and fingerprinted")
+    parser.add_argument("folder",
+                        nargs='?',
+                        default=os.getcwd(),  # Current directory
+                        help="the presentation to build, defaults to current "
+                        "directory")
+    parser.add_argument("-o", "--output",
+                        help="where to write the build, defaults to the "
+                        "folder name with -build, next to the folder")
+    parser.add_argument("-t", "--template",
+                        default="nlesc",
+                        help="template to render with, defaults to "
+                        "%(default)s")
+    parser.add_argument("-z", "--zip",
+                        action="store_true",
+                        help="write a zip file instead of a folder")
+    return parser.parse_args(argv)
+
+
+def export_args(argv: List[str]) -> argparse.Namespace:
+    parser: argparse.ArgumentParser = argparse.ArgumentParser(
+        prog=os.path.basename(sys.argv[0]) + " export",
+        description="Export a reveal.js presentation to a single HTML file "
+        "that works without a network, with the reveal.js files and the "
+        "presentation's files inlined")
+    parser.add_argument("folder",
+                        nargs='?',
+                        default=os.getcwd(),  # Current directory
+                        help="the presentation to export, defaults to "
+                        "current directory")
+    # Not in the presentation folder, where it would become a slide
+    parser.add_argument("-o", "--output",
+                        help="the file to write, defaults to the folder name "
+                        "with .html, next to the folder")
+    parser.add_argument("-t", "--template",
+                        default="nlesc",
+                        help="template to render with, defaults to "
+                        "%(default)s")
+    parser.add_argument("--no-cache",
+                        action="store_true",
+                        help="process all files again instead of using the "
+                        "ones processed by earlier exports")
+    return parser.parse_args(argv)
+
+
+def export_pdf_args(argv: List[str]) -> argparse.Namespace:
+    from reveal_pdf import PDF_WORKERS
+
+    parser: argparse.ArgumentParser = argparse.ArgumentParser(
+        prog=os.path.basename(sys.argv[0]) + " export-pdf",
+        description="Print a reveal.js presentation to PDF with a headless "
+        "Chrome, Chromium or Edge, slide by slide, reusing the slides that "
+        "did not change since the last export")
+    parser.add_argument("folder",
+                        nargs='?',
+                        default=os.getcwd(),  # Current directory
+                        help="the presentation to print, defaults to current "
+                        "directory")
+    parser.add_argument("-o", "--output",
+                        help="the file to write, defaults to the folder name "
+                        "with .pdf, next to the folder")
+    parser.add_argument("-t", "--template",
+                        default="nlesc",
+                        help="template to render with, defaults to "
+                        "%(default)s")
+    parser.add_argument("-b", "--browser",
+                        help="the browser to print with, defaults to the "
+                        "first Chrome, Chromium or Edge found")
+    parser.add_argument("-j", "--jobs",
+                        type=int,
+                        default=PDF_WORKERS,
+                        help="how many slides to print at once, defaults to "
+                        "%(default)s")
+    parser.add_argument("--no-cache",
+                        action="store_true",
+                        help="print all slides again instead of reusing the "
+                        "ones printed by earlier exports")
+    return parser.parse_args(argv)
+
+
 def launched_from_terminal() -> bool:
     # https://stackoverflow.com/questions/9839240/how-to-determine-if-python-script-was-run-via-command-line
     # TODO detect on Windows too
@@ -65,41 +174,184 @@ def launched_from_terminal() -> bool:
     return sys.stdin and sys.stdin.isatty()
 
 
-def run_cli(args: argparse.Namespace, config: Dict[str, Any]) -> None:
-    server = livereload.Server()
-    server.watch(args.folder)
+def reveal_mounts(reveal_deployment: str) -> Dict[str, str]:
+    # Presentation folders without their own copy of reveal.js get it from
+    # the server. Folders with one, or with a link to the shared store, are
+    # served their own, see MountFileMixin.
+    if reveal_deployment in ["mount", "symlink"]:
+        return {"reveal.js": os.path.join(BASE_DIRECTORY, "reveal.js")}
+    return {}
+
+
+# Only the runtime files of the manifest are served from the mount
+def reveal_mount_files(reveal_deployment: str,
+                       reveal_manifest: Dict[str, List[str]]) \
+        -> Dict[str, List[str]]:
+    from reveal_assets import runtime_files
+
+    return {prefix: runtime_files(directory, reveal_manifest)
+            for prefix, directory in reveal_mounts(reveal_deployment).items()}
 
-    running_watch = threading.Event()
-    running_watch.set()
 
-    running_refreshing = threading.Event()
+# Makes and serves the image variants, None if there are no widths
+# configured or Pillow is not installed
+def image_pipeline(image_widths: List[int]) -> Optional["ImagePipeline"]:
+    from reveal_assets import cache_directory
+    from reveal_images import ImagePipeline
+
+    if not image_widths:
+        return None
+    if not ImagePipeline.available():
+        print("Pillow is not installed, serving images as they are")
+        return None
+    return ImagePipeline(cache_directory("images"), image_widths)
+
+
+def image_mounts(images: Optional["ImagePipeline"]) -> Dict[str, str]:
+    from reveal_images import IMAGE_MOUNT
+
+    return {} if images is None else {IMAGE_MOUNT: images.directory}
+
+
+def serve_ready() -> None:
+    from reveal_timings import timings
+
+    elapsed: float = time.perf_counter() - STARTED
+    print("Ready in %.2f s" % elapsed)
+    timings.record("serve.ready", elapsed)
+
+
+def run_cli(args: argparse.Namespace, config: Dict[str, Any]) -> None:
+    from reveal_cli import DeckHost, WatchController, WatchSession
+    from reveal_server import Server
+
+    images = image_pipeline(config["image_widths"])
+    server = Server(caching=config["http_caching"],
+                    compression=config["http_compression"],
+                    mounts={**reveal_mounts(config["reveal_deployment"]),
+                            **image_mounts(images)},
+                    mount_files=reveal_mount_files(
+                        config["reveal_deployment"],
+                        config["reveal_manifest"]),
+                    decks={} if len(args.folders) > 1 else None)
 
     template_file = os.path.join(BASE_DIRECTORY, "nlesc.template")
-    watching = threading.Thread(target=watch_for_changes,
-                                args=(args.folder,
-                                      template_file,
-                                      running_watch,
-                                      running_refreshing),
-                                daemon=True)
-    watching.start()
+    watches = WatchController()
+    if server.decks is None:
+        watches.start(WatchSession(args.folders[0],
+                                   template_file,
+                                   config["refresh_delay"],
+                                   config["watch_ignore"],
+                                   server.notify,
+                                   config["stream_render"],
+                                   config["prerender_markdown"],
+                                   config["reveal_specs"],
+                                   images))
+    else:
+        decks = DeckHost(server, watches,
+                         refresh_delay=config["refresh_delay"],
+                         ignore_patterns=config["watch_ignore"],
+                         stream=config["stream_render"],
+                         prerender=config["prerender_markdown"],
+                         reveal_specs=config["reveal_specs"],
+                         images=images)
+        for folder in args.folders:
+            name = decks.add(folder, template_file)
+            print(f"Serving {folder} on http://127.0.0.1:{args.port}/{name}/")
 
     try:
-        server.serve(port=args.port, root=args.folder)
+        server.serve(port=args.port, root=args.folders[0], ready=serve_ready)
     except KeyboardInterrupt:
         pass
     finally:
         print()
         print("Stop serving")
-        running_watch.clear()
-        watching.join()
+        watches.stop_all()
+        if images is not None:
+            images.shutdown()
+
+
+def run_build(args: argparse.Namespace, config: Dict[str, Any]) -> None:
+    from reveal_build import build
+
+    # Not in the presentation folder, where the next build would find it
+    output: str = args.output or \
+        os.path.abspath(args.folder).rstrip(os.sep) + "-build"
+    try:
+        built: str = build(args.folder,
+                           os.path.join(BASE_DIRECTORY,
+                                        args.template + ".template"),
+                           output,
+                           os.path.join(BASE_DIRECTORY, "reveal.js"),
+                           config["reveal_manifest"],
+                           config["reveal_specs"],
+                           config["prerender_markdown"],
+                           config["watch_ignore"],
+                           args.zip)
+    except RuntimeError as e:
+        sys.exit(f"Cannot build: {e}")
+    print("Built " + built)
+
+
+def run_export(args: argparse.Namespace, config: Dict[str, Any]) -> None:
+    from reveal_export import export
+
+    output: str = args.output or \
+        os.path.abspath(args.folder).rstrip(os.sep) + ".html"
+    external: List[str] = export(args.folder,
+                                 os.path.join(BASE_DIRECTORY,
+                                              args.template + ".template"),
+                                 output,
+                                 os.path.join(BASE_DIRECTORY, "reveal.js"),
+                                 config["reveal_specs"],
+                                 not args.no_cache)
+    for url in external:
+        print("Not inlined, needs a network: " + url)
+    print("Exported " + output)
+
+
+def run_export_pdf(args: argparse.Namespace, config: Dict[str, Any]) -> None:
+    from reveal_pdf import export_pdf
+
+    output: str = args.output or \
+        os.path.abspath(args.folder).rstrip(os.sep) + ".pdf"
+    try:
+        export_pdf(args.folder,
+                   os.path.join(BASE_DIRECTORY, args.template + ".template"),
+                   output,
+                   config["reveal_specs"],
+                   reveal_mounts(config["reveal_deployment"]),
+                   args.browser,
+                   args.jobs,
+                   not args.no_cache)
+    except RuntimeError as e:
+        sys.exit(f"Cannot print to PDF: {e}")
+    print("Exported " + output)
 
 
 def run_gui(args: argparse.Namespace, config: Dict[str, Any]) -> None:
+    import tkinter as tk
+
+    from reveal_assets import Progress, copy_tree, deploy
+    from reveal_cli import WatchController, WatchSession
+    from reveal_gui import Gui
+    from reveal_server import Server
+    from reveal_tasks import TaskRunner
+    from reveal_timings import timings
 
     default_port: int = config["default_port"]
     warning_color: str = config["warning_color"]
     all_plugins: Dict[str, str] = config["all_plugins"]
-    reveal_specs: Dict[str, List[str]] = config["reveal_specs"]
+    reveal_specs: Dict[str, Dict[str, List[str]]] = config["reveal_specs"]
+    refresh_delay: float = config["refresh_delay"]
+    watch_ignore: List[str] = config["watch_ignore"]
+    stream_render: bool = config["stream_render"]
+    prerender_markdown: bool = config["prerender_markdown"]
+    http_caching: bool = config["http_caching"]
+    http_compression: bool = config["http_compression"]
+    reveal_deployment: str = config["reveal_deployment"]
+    reveal_manifest: Dict[str, List[str]] = config["reveal_manifest"]
+    images: Optional[ImagePipeline] = image_pipeline(config["image_widths"])
 
     root: tk.Tk = tk.Tk()
 
@@ -121,66 +373,137 @@ def run_gui(args: argparse.Namespace, config: Dict[str, Any]) -> None:
 
     # If we set it before updating and setting size, the width will be messed
     # up. No idea why.
-    app.set_folder(args.folder)
+    app.set_folder(args.folders[0])
 
     class Logic(app.Logic):
         def __init__(self):
-            self.server = livereload.Server()
-            self.running_watch = threading.Event()
-            self.running_refreshing = threading.Event()
+            self.server = Server(caching=http_caching,
+                                 compression=http_compression,
+                                 mounts={**reveal_mounts(reveal_deployment),
+                                         **image_mounts(images)},
+                                 mount_files=reveal_mount_files(
+                                     reveal_deployment, reveal_manifest))
+            self.watches: WatchController = WatchController()
+            self.session: Optional[WatchSession] = None
+            # All disk I/O and server starts and stops go through here, so
+            # the window stays responsive on slow or network folders
+            self.tasks: TaskRunner = TaskRunner(root, busy=self.show_busy)
             if app.state.get() == "valid path":
                 self.refresh_metadata()
 
+        def show_busy(self, busy: bool) -> None:
+            root.configure(cursor="watch" if busy else "")
+
         def run(self):
             print("run from outside")
-            self.use_folder()
-            self.write_to_title_slide()
             presentation_path: str = app.presentation_path.get()
-            self.server.watch(presentation_path)
-            self.running_watch.set()
+            port = app.port.get()
             template_file = \
                 os.path.join(BASE_DIRECTORY,
                              app.active_template.get() + ".template")
-            self.watching = threading.Thread(target=watch_for_changes,
-                                             args=(presentation_path,
-                                                   template_file,
-                                                   self.running_watch,
-                                                   self.running_refreshing),
-                                             daemon=True)
-            self.watching.start()
-            port = app.port.get()
-            self.serving_process = \
-                multiprocessing.Process(target=self.server.serve,
-                                        kwargs={"port": port,
-                                                "root": presentation_path})
-            self.serving_process.start()
+            app.show_progress("Starting")
+            self.tasks.submit(self.start, presentation_path, port,
+                              template_file, self.title_slide_content(),
+                              done=lambda _: app.show_progress(None),
+                              failed=self.start_failed, serial=True)
+
+        def start_failed(self, error: Exception) -> None:
+            print("could not start:", error)
+            app.show_progress(None)
+
+        # Runs on a worker thread, so it must not touch the widgets
+        def start(self, presentation_path: str, port: str,
+                  template_file: str, title_slide_content: List[str]) -> None:
+            # Run again, for example with another port or template
+            self.stop_serving()
+            self.use_folder(presentation_path)
+            self.write_to_title_slide(presentation_path, title_slide_content)
+            self.server.start(int(port), presentation_path)
+            self.session = WatchSession(presentation_path, template_file,
+                                        refresh_delay, watch_ignore,
+                                        self.server.notify, stream_render,
+                                        prerender_markdown, reveal_specs,
+                                        images)
+            self.watches.start(self.session)
 
         def stop(self):
             print("stop from outside")
-            try:
-                self.serving_process.terminate()
-                self.running_watch.clear()
-                self.watching.join()
-            except AttributeError:
-                print("nothing to kill, because nothing has started yet...")
+            self.tasks.submit(self.stop_serving, serial=True)
+
+        def stop_serving(self) -> None:
+            self.server.stop()
+            self.watches.stop_all()
+            self.session = None
+
+        # A template, version or plugin was chosen while serving. The running
+        # session re-renders index.html and the browser reloads once, without
+        # restarting the server or the watcher.
+        def reconfigure(self):
+            print("reconfigure from outside")
+            template_file = \
+                os.path.join(BASE_DIRECTORY,
+                             app.active_template.get() + ".template")
+            self.tasks.submit(self.apply_configuration,
+                              app.presentation_path.get(), template_file,
+                              self.title_slide_content(),
+                              failed=lambda error: print(
+                                  "cannot apply changes:", error),
+                              serial=True)
+
+        def apply_configuration(self, presentation_path: str,
+                                template_file: str,
+                                title_slide_content: List[str]) -> None:
+            session: Optional[WatchSession] = self.session
+            if session is None or session.path != presentation_path:
+                return
+            # Plugins and version live in the title slide, the watcher picks
+            # up the change
+            self.write_to_title_slide(presentation_path, title_slide_content)
+            session.set_template(template_file)
 
         def refresh_metadata(self):
             print("refresh metadata from outside")
-            try:
-                metadata_dict: Dict[str] = self.read_metadata()
-                app.title_string.set(metadata_dict["title"])
-                app.description_string.set(metadata_dict["description"])
-                app.author_string.set(metadata_dict["author"])
-            except IndexError:
+            presentation_path: str = app.presentation_path.get()
+            self.tasks.submit(self.read_metadata, presentation_path,
+                              done=lambda metadata: self.show_metadata(
+                                  presentation_path, metadata),
+                              failed=self.metadata_failed)
+
+        def show_metadata(self, presentation_path: str,
+                          metadata_dict: Dict[str, str]) -> None:
+            # Another folder was chosen in the meantime
+            if presentation_path != app.presentation_path.get():
+                return
+            app.title_string.set(metadata_dict["title"])
+            app.description_string.set(metadata_dict["description"])
+            app.author_string.set(metadata_dict["author"])
+
+        def metadata_failed(self, error: Exception) -> None:
+            if isinstance(error, IndexError):
                 print("no metadata, since there are no files yet")
+            else:
+                print("cannot read metadata:", error)
 
-        def use_folder(self):
+        def use_folder(self, presentation_directory: str) -> None:
             print("using folder from outsite")
-            self.place_reveal_folder()
-            self.place_sample_files()
-
-        def get_title_slide(self):
-            presentation_path: str = app.presentation_path.get()
+            with timings.stage("place_folder",
+                               deck=os.path.abspath(presentation_directory)):
+                self.place_reveal_folder(presentation_directory)
+                self.place_sample_files(presentation_directory)
+
+        # Shows the progress on the "Run" button, only when the percentage
+        # changes, so the main thread is not flooded with updates
+        def report_progress(self, label: str) -> Progress:
+            shown: List[int] = [-1]
+
+            def progress(done: int, total: int) -> None:
+                percent: int = 100 * done // max(total, 1)
+                if percent != shown[0]:
+                    shown[0] = percent
+                    self.tasks.post(app.show_progress, f"{label} {percent}%")
+            return progress
+
+        def get_title_slide(self, presentation_path: str) -> str:
             all_files: List[str] = os.listdir(presentation_path)
             content_files = [x for x in all_files if x != "index.html"
                              and x.endswith(".html") or x.endswith(".md")]
@@ -189,8 +512,8 @@ def run_gui(args: argparse.Namespace, config: Dict[str, Any]) -> None:
                                             content_files[0])
             return title_slide
 
-        def read_metadata(self) -> Dict[str, str]:
-            title_slide: str = self.get_title_slide()
+        def read_metadata(self, presentation_path: str) -> Dict[str, str]:
+            title_slide: str = self.get_title_slide(presentation_path)
             f: TextIO
             with open(title_slide) as f:
                 slide_text: str = f.readlines()
@@ -214,17 +537,8 @@ def run_gui(args: argparse.Namespace, config: Dict[str, Any]) -> None:
                     "with \"" + text + "\", not \"" + line.split()[0] + "\"."
                 raise SyntaxError(error_text)
 
-        def write_to_title_slide(self) -> None:
-            header_lines: List[str] = ["<!--",
-                                       "title:",
-                                       "description:",
-                                       "author:",
-                                       "version:",
-                                       "plugins:",
-                                       "-->"]
-
-            title_slide: str = self.get_title_slide()
-
+        # The header of the title slide as set in the window
+        def title_slide_content(self) -> List[str]:
             active_plugins = [box.cget("text") for box in app.plugin_checkboxes
                               if box.state() == ('selected',)]
 
@@ -243,10 +557,24 @@ def run_gui(args: argparse.Namespace, config: Dict[str, Any]) -> None:
                 ", ".join(active_plugins),
                 ""
             ]
+            return new_content
+
+        def write_to_title_slide(self, presentation_path: str,
+                                 new_content: List[str]) -> None:
+            header_lines: List[str] = ["<!--",
+                                       "title:",
+                                       "description:",
+                                       "author:",
+                                       "version:",
+                                       "plugins:",
+                                       "-->"]
+
+            title_slide: str = self.get_title_slide(presentation_path)
 
             f: TextIO
             with open(title_slide) as f:
                 slide_text: str = f.readlines()
+            original_text: List[str] = list(slide_text)
 
             line_number: int
             header_line: str
@@ -261,23 +589,27 @@ def run_gui(args: argparse.Namespace, config: Dict[str, Any]) -> None:
                 slide_text[line_number]: str = slide_text[line_number].replace(
                     old_content, new_content[line_number])
 
+            if slide_text == original_text:
+                # Writing would only make the watcher re-read the slide
+                return
             with open(title_slide, 'w') as f:
                 f.writelines(slide_text)
 
-        def place_reveal_folder(self) -> None:
-            presentation_directory: str = app.presentation_path.get()
+        def place_reveal_folder(self, presentation_directory: str) -> None:
             reveal_path: str = os.path.join(presentation_directory,
                                             "reveal.js")
             if not os.path.isdir(reveal_path) \
-                    and not os.path.isfile(reveal_path):
+                    and not os.path.isfile(reveal_path) \
+                    and not os.path.islink(reveal_path):
                 source_dir: str = os.path.join(BASE_DIRECTORY,
                                                "reveal.js")
-                shutil.copytree(source_dir, reveal_path)
+                deploy(source_dir, reveal_path, reveal_deployment,
+                       reveal_manifest,
+                       self.report_progress("Copying reveal.js"))
             else:
                 print("reveal.js already exists, not overwriting")
 
-        def place_sample_files(self) -> None:
-            presentation_directory: str = app.presentation_path.get()
+        def place_sample_files(self, presentation_directory: str) -> None:
             all_files: str = os.listdir(presentation_directory)
             content_files = [x for x in all_files if x != "index.html"
                              and x.endswith(".html") or x.endswith(".md")]
@@ -292,8 +624,9 @@ def run_gui(args: argparse.Namespace, config: Dict[str, Any]) -> None:
 
             if not os.path.isdir(os.path.join(presentation_directory,
                                  "files")):
-                shutil.copytree(os.path.join(BASE_DIRECTORY, "files"),
-                                os.path.join(presentation_directory, "files"))
+                copy_tree(os.path.join(BASE_DIRECTORY, "files"),
+                          os.path.join(presentation_directory, "files"),
+                          progress=self.report_progress("Copying files"))
             else:
                 print("\"files\" already exists, not overwriting")
 
@@ -307,19 +640,56 @@ def run_gui(args: argparse.Namespace, config: Dict[str, Any]) -> None:
     root.mainloop()
 
     # Clean up if the window is closed
-    logic.stop()
+    logic.tasks.shutdown()
+    logic.stop_serving()
+    if images is not None:
+        images.shutdown()
+
+def load_config() -> Dict[str, Any]:
+    import yaml
+
+    f: TextIO
+    with open(os.path.join(BASE_DIRECTORY, CONFIG_FILE_NAME)) as f:
+        # TODO use yatiml instead
+        return yaml.safe_load(f)
+
 
 def main() -> None:
+    if sys.argv[1:2] == ["build"]:
+        run_build(args=build_args(sys.argv[2:]), config=load_config())
+        return
+    if sys.argv[1:2] == ["export"]:
+        run_export(args=export_args(sys.argv[2:]), config=load_config())
+        return
+    if sys.argv[1:2] == ["export-pdf"]:
+        run_export_pdf(args=export_pdf_args(sys.argv[2:]),
+                       config=load_config())
+        return
+
     args: argparse.Namespace = cli_args()
 
+    if args.debug:
+        import logging
+
+        logging.basicConfig(level=logging.DEBUG)
+        elapsed: float = time.perf_counter() - STARTED
+        print("Started in %.0f ms, %s the budget of %.0f ms" %
+              (elapsed * 1000, "within" if elapsed <= STARTUP_BUDGET
+               else "over", STARTUP_BUDGET * 1000))
+
     if args.version:
         print(NAME, __version__)
         sys.exit()
 
-    f: TextIO
-    with open(os.path.join(BASE_DIRECTORY, CONFIG_FILE_NAME)) as f:
-        # TODO use yatiml instead
-        config: Dict[str, Any] = yaml.safe_load(f)
+    from reveal_timings import timings
+
+    if args.timings or args.trace:
+        timings.enable(args.trace)
+        timings.record("startup", time.perf_counter() - STARTED)
+    with timings.stage("config"):
+        config: Dict[str, Any] = load_config()
+
+    import platform
 
     # Launched_from_terminal does not work on Windows. Until that is fixed, the
     # Windows platform only gets the GUI.
@@ -0,0 +1,278 @@
+#!/usr/bin/env python3
+
+# Where reveal.js comes from: the shared, versioned store that presentation
+# folders link to or that the server mounts, instead of a full copy of
+# reveal.js in every presentation folder. Also copies files into
+# presentation folders, in parallel and with progress reports.
+
+import concurrent.futures
+import glob
+import hashlib
+import os
+import platform
+import shutil
+import tempfile
+import threading
+
+from typing import Callable, Dict, List, Optional, Set
+
+
+# How a presentation folder gets its reveal.js:
+# - mount: nothing is placed, the server serves /reveal.js/ from the bundled
+#   reveal.js folder
+# - symlink: a link to the shared store
+# - hardlink: a copy of the shared store made of hard links
+# - copy: a full copy
+DEPLOYMENT_MODES: List[str] = ["mount", "symlink", "hardlink", "copy"]
+
+# Files copied at the same time. Copying is mostly waiting for the disk, so
+# this may exceed the number of CPUs.
+COPY_WORKERS: int = min(8, (os.cpu_count() or 1) * 2)
+# Bytes per copy_file_range call
+COPY_CHUNK_SIZE: int = 8 * 2**20
+
+# Called with the bytes copied so far and the total, from the copying threads
+Progress = Callable[[int, int], None]
+
+
+def cache_directory(*names: str) -> str:
+    if platform.system() == "Windows":
+        base: str = os.environ.get("LOCALAPPDATA",
+                                   os.path.expanduser("~"))
+    elif platform.system() == "Darwin":
+        base = os.path.expanduser(os.path.join("~", "Library", "Caches"))
+    else:
+        base = os.environ.get("XDG_CACHE_HOME",
+                              os.path.expanduser(os.path.join("~", ".cache")))
+    return os.path.join(base, "reveal_launcher", *names)
+
+
+# Like cache_directory, but for files that must not disappear, since
+# presentation folders link to them.
+def data_directory(*names: str) -> str:
+    if platform.system() == "Windows":
+        base: str = os.environ.get("LOCALAPPDATA",
+                                   os.path.expanduser("~"))
+    elif platform.system() == "Darwin":
+        base = os.path.expanduser(
+            os.path.join("~", "Library", "Application Support"))
+    else:
+        base = os.environ.get(
+            "XDG_DATA_HOME",
+            os.path.expanduser(os.path.join("~", ".local", "share")))
+    return os.path.join(base, "reveal_launcher", *names)
+
+
+# The files of the reveal.js folder matched by the manifest patterns of all
+# versions, relative to that folder. A manifest maps reveal.js versions to
+# glob patterns, see reveal_manifest in config.yaml.
+def runtime_files(source_dir: str, manifest: Dict[str, List[str]]) \
+        -> List[str]:
+    files: Set[str] = set()
+    pattern: str
+    for pattern in [x for patterns in manifest.values() for x in patterns]:
+        path: str
+        for path in glob.glob(os.path.join(glob.escape(source_dir), pattern),
+                              recursive=True):
+            if os.path.isfile(path):
+                files.add(os.path.relpath(path, source_dir))
+    return sorted(files)
+
+
+# All files below `source_dir`, relative to it
+def tree_files(source_dir: str) -> List[str]:
+    files: List[str] = []
+    directory: str
+    names: List[str]
+    for directory, _, names in os.walk(source_dir):
+        files.extend(os.path.relpath(os.path.join(directory, x), source_dir)
+                     for x in names)
+    return sorted(files)
+
+
+# Copies in the kernel with copy_file_range, which file systems like btrfs
+# and XFS turn into a reflink. Falls back to shutil.copy2, which uses
+# sendfile on Linux and fcopyfile on macOS. Some file systems (FUSE, CIFS,
+# NFS) and older kernels across mounts copy nothing and report the end of
+# the file instead of an error, so the copy only counts if it has the size
+# of the source.
+def fast_copy(source: str, destination: str) -> None:
+    if hasattr(os, "copy_file_range"):
+        try:
+            with open(source, "rb") as src, open(destination, "wb") as dst:
+                size: int = os.fstat(src.fileno()).st_size
+                copied: int = 0
+                while True:
+                    count: int = os.copy_file_range(
+                        src.fileno(), dst.fileno(), COPY_CHUNK_SIZE)
+                    if not count:
+                        break
+                    copied += count
+            if copied == size == os.path.getsize(destination):
+                shutil.copystat(source, destination)
+                return
+        except OSError:
+            # Not supported by the kernel or between these file systems
+            pass
+    shutil.copy2(source, destination)
+
+
+# Copies `files`, relative to `source_dir`, on a thread pool
+def copy_files(source_dir: str, destination: str, files: List[str],
+               copy_function=fast_copy,
+               progress: Optional[Progress] = None) -> None:
+    sizes: List[int] = [os.path.getsize(os.path.join(source_dir, x))
+                        for x in files]
+    total: int = sum(sizes)
+    done: int = 0
+    lock: threading.Lock = threading.Lock()
+
+    def copy(file: str, size: int) -> None:
+        nonlocal done
+        copy_function(os.path.join(source_dir, file),
+                      os.path.join(destination, file))
+        with lock:
+            done += size
+            if progress is not None:
+                progress(done, total)
+
+    # Create the directories up front, so the copies do not race for them
+    directory: str
+    for directory in sorted({os.path.dirname(os.path.join(destination, x))
+                             for x in files} | {destination}):
+        os.makedirs(directory, exist_ok=True)
+    with concurrent.futures.ThreadPoolExecutor(COPY_WORKERS) as pool:
+        future: concurrent.futures.Future
+        for future in [pool.submit(copy, file, size)
+                       for file, size in zip(files, sizes)]:
+            future.result()
+
+
+def copy_tree(source_dir: str, destination: str, copy_function=fast_copy,
+              progress: Optional[Progress] = None) -> None:
+    copy_files(source_dir, destination, tree_files(source_dir),
+               copy_function, progress)
+
+
+# Copy the reveal.js folder, or only the files listed by the manifest
+def copy_reveal(source_dir: str, destination: str,
+                manifest: Optional[Dict[str, List[str]]] = None,
+                copy_function=fast_copy,
+                progress: Optional[Progress] = None) -> None:
+    files: List[str] = tree_files(source_dir) if manifest is None \
+        else runtime_files(source_dir, manifest)
+    copy_files(source_dir, destination, files, copy_function, progress)
+
+
+# Content hash of `files`, relative to the folder `source`, with their names
+def files_digest(source: str, files: List[str]) -> str:
+    hasher = hashlib.sha256()
+    file: str
+    for file in files:
+        hasher.update(file.replace(os.sep, "/").encode() + b"\0")
+        with open(os.path.join(source, file), "rb") as f:
+            for block in iter(lambda: f.read(2**20), b""):
+                hasher.update(block)
+        hasher.update(b"\0")
+    return hasher.hexdigest()
+
+
+# Copies every entry (version folder, custom_css) of the bundled reveal.js
+# folder into the shared store, unless the same content is there already.
+# Each entry has a .<entry>.digest file next to it in the store, so that an
+# entry a launcher update changed is replaced. Returns the path of the store.
+def shared_store(source_dir: str,
+                 manifest: Optional[Dict[str, List[str]]] = None,
+                 progress: Optional[Progress] = None) -> str:
+    store: str = data_directory("reveal.js")
+    os.makedirs(store, exist_ok=True)
+    entry: str
+    for entry in sorted(os.listdir(source_dir)):
+        target: str = os.path.join(store, entry)
+        source: str = os.path.join(source_dir, entry)
+        files: List[str]
+        if os.path.isfile(source):
+            files = []
+        elif manifest is None:
+            files = tree_files(source)
+        else:
+            files = [os.path.relpath(x, entry)
+                     for x in runtime_files(source_dir, manifest)
+                     if x.startswith(entry + os.sep)]
+        digest: str = files_digest(source, files) if files \
+            else files_digest(source_dir, [entry])
+        digest_file: str = os.path.join(store, "." + entry + ".digest")
+        try:
+            with open(digest_file) as f:
+                if os.path.exists(target) and f.read().strip() == digest:
+                    continue
+        except OSError:
+            pass
+        # Copy to a temporary name first, so that an interrupted copy
+        # never looks complete.
+        temporary: str = tempfile.mkdtemp(prefix="." + entry + ".",
+                                          dir=store)
+        os.rmdir(temporary)
+        if os.path.isfile(source):
+            shutil.copy2(source, temporary)
+        else:
+            copy_files(source, temporary, files, progress=progress)
+        # Move a stale entry out of the way first. Links to the store keep
+        # working, since they point at the store, not at the entry.
+        stale: Optional[str] = None
+        if os.path.lexists(target):
+            stale = tempfile.mkdtemp(prefix="." + entry + ".stale.",
+                                     dir=store)
+            try:
+                os.replace(target, os.path.join(stale, entry))
+            except OSError:
+                pass
+        try:
+            os.rename(temporary, target)
+        except OSError:
+            # Someone else completed it in the meantime
+            if os.path.isdir(temporary):
+                shutil.rmtree(temporary, ignore_errors=True)
+            elif os.path.exists(temporary):
+                os.remove(temporary)
+        else:
+            with open(digest_file, "w") as f:
+                f.write(digest)
+        if stale is not None:
+            shutil.rmtree(stale, ignore_errors=True)
+    return store
+
+
+def link_or_copy(source: str, destination: str) -> None:
+    try:
+        os.link(source, destination)
+    except OSError:
+        # Other file system, or no hard link support
+        shutil.copy2(source, destination)
+
+
+def deploy(source_dir: str, destination: str, mode: str,
+           manifest: Optional[Dict[str, List[str]]] = None,
+           progress: Optional[Progress] = None) -> None:
+    if mode not in DEPLOYMENT_MODES:
+        raise ValueError("reveal.js deployment must be one of " +
+                         ", ".join(DEPLOYMENT_MODES) + ", not \"" + mode +
+                         "\".")
+    if mode == "mount":
+        print("serving reveal.js from " + source_dir)
+        return
+    if mode == "symlink":
+        try:
+            os.symlink(shared_store(source_dir, manifest, progress),
+                       destination,
+                       target_is_directory=True)
+            return
+        except OSError:
+            # Windows needs extra privileges for symbolic links
+            print("cannot create a symbolic link, copying reveal.js")
+            mode = "copy"
+    if mode == "hardlink":
+        copy_reveal(shared_store(source_dir, manifest, progress),
+                    destination, manifest, link_or_copy, progress)
+    else:
+        copy_reveal(source_dir, destination, manifest, progress=progress)
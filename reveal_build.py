@@ -0,0 +1,352 @@
+#!/usr/bin/env python3
+
+# Builds a presentation folder into a static site for hosting on a CDN:
+# index.html rendered once and minified, only the reveal.js files that the
+# enabled plugins need, and fingerprinted file names, so that browsers and
+# caches may keep every file forever.
+
+import hashlib
+import os
+import posixpath
+import re
+import shutil
+import tempfile
+import zipfile
+
+from reveal_assets import fast_copy, runtime_files, tree_files
+from reveal_cli import SlideCache, WATCH_IGNORE, index_settings, \
+    is_ignored, load_template
+from typing import Dict, List, Optional, Set, Tuple
+
+
+# Where the reveal.js files go in the build, followed by the fingerprint
+ASSETS_DIRECTORY: str = "assets"
+FINGERPRINT_LENGTH: int = 10
+# Written into every build folder. Only folders that have it, or empty ones,
+# are replaced by the next build.
+BUILD_MARKER: str = ".reveal-build"
+
+REVEAL_REFERENCE: re.Pattern = \
+    re.compile(r"(?<=[\"'])(?:\./)?reveal\.js/([^\"'?#]+)")
+CSS_URL: re.Pattern = re.compile(r"url\(\s*([\"']?)([^)\"']+)\1\s*\)")
+CSS_IMPORT: re.Pattern = re.compile(r"@import\s+([\"'])([^\"']+)\1")
+# Comments and string literals, whose whitespace is content
+CSS_VERBATIM: re.Pattern = re.compile(
+    r"(/\*.*?\*/|\"(?:[^\"\\]|\\.)*\"|'(?:[^'\\]|\\.)*')", re.DOTALL)
+# Not around ":", which is also part of selectors like "a :hover"
+CSS_SPACE: re.Pattern = re.compile(r"\s*([{};,>])\s*")
+# Elements whose content is left as it is: whitespace matters in them, or
+# they are not HTML
+HTML_VERBATIM: re.Pattern = \
+    re.compile(r"(<(pre|textarea|script|style)\b.*?</\2\s*>)",
+               re.DOTALL | re.IGNORECASE)
+HTML_COMMENT: re.Pattern = re.compile(r"<!--(?!\[if).*?-->", re.DOTALL)
+HTML_STYLE: re.Pattern = \
+    re.compile(r"(<style\b[^>]*>)(.*?)(</style\s*>)",
+               re.DOTALL | re.IGNORECASE)
+# Markdown slides that the markdown plugin loads from their file
+MARKDOWN_REFERENCE: re.Pattern = re.compile(r"(data-markdown=\")([^\"]+)\"")
+
+
+def minify_css(text: str) -> str:
+    parts: List[str] = CSS_VERBATIM.split(text)
+    result: List[str] = []
+    index: int
+    for index, part in enumerate(parts):
+        if index % 2:
+            # Comments go, strings stay as they are
+            if not part.startswith("/*"):
+                result.append(part)
+            continue
+        part = CSS_SPACE.sub(r"\1", part)
+        part = re.sub(r":\s+", ":", part)
+        part = re.sub(r"\s+", " ", part)
+        result.append(part.replace(";}", "}"))
+    return "".join(result).strip()
+
+
+# Collapses whitespace and drops comments outside of <pre>, <textarea>,
+# <script> and <style>, and minifies the stylesheets in <style>. Comments
+# with reveal.js attributes (<!-- .element: ... -->) are kept.
+def minify_html(text: str) -> str:
+    parts: List[str] = HTML_VERBATIM.split(text)
+    result: List[str] = []
+    index: int
+    for index in range(0, len(parts), 3):
+        outside: str = HTML_COMMENT.sub(
+            lambda x: x.group(0)
+            if ".element" in x.group(0) or ".slide" in x.group(0) else "",
+            parts[index])
+        result.append(re.sub(r"\s+", " ", outside))
+        if index + 1 < len(parts):
+            result.append(HTML_STYLE.sub(
+                lambda x: x.group(1) + minify_css(x.group(2)) + x.group(3),
+                parts[index + 1]))
+    return "".join(result).strip()
+
+
+def is_external(url: str) -> bool:
+    return url.startswith(("data:", "http:", "https:", "//", "#"))
+
+
+# Files a stylesheet refers to, relative to the folder of `css_file`
+def css_references(text: str) -> List[str]:
+    return [x.group(2) for x in CSS_URL.finditer(text)] + \
+        [x.group(2) for x in CSS_IMPORT.finditer(text)]
+
+
+# The reveal.js files needed by `index_html`, relative to the reveal.js
+# folder: the referenced files, what the referenced stylesheets refer to,
+# and the whole folder of every referenced plugin, since plugins load
+# their own files at runtime.
+def reveal_dependencies(index_html: str, reveal_dir: str,
+                        available: Set[str]) -> Set[str]:
+    queue: List[str] = [x.group(1) for x in REVEAL_REFERENCE.finditer(
+        index_html)]
+    needed: Set[str] = set()
+    while queue:
+        file: str = posixpath.normpath(queue.pop())
+        if file in needed:
+            continue
+        if file not in available:
+            print(f"not in the reveal.js manifest, skipping: {file}")
+            continue
+        needed.add(file)
+        if file.endswith(".css"):
+            with open(os.path.join(reveal_dir, file), encoding="utf-8",
+                      errors="replace") as f:
+                queue += [posixpath.join(posixpath.dirname(file),
+                                         re.split(r"[?#]", x)[0])
+                          for x in css_references(f.read())
+                          if not is_external(x)]
+        elif file.endswith(".js") and "/dist/" not in "/" + file:
+            folder: str = posixpath.dirname(file) + "/"
+            queue += [x for x in available if x.startswith(folder)]
+    return needed
+
+
+def fingerprint(content: bytes) -> str:
+    return hashlib.sha256(content).hexdigest()[:FINGERPRINT_LENGTH]
+
+
+def fingerprinted_name(file: str, content: bytes) -> str:
+    stem, extension = posixpath.splitext(file)
+    return f"{stem}.{fingerprint(content)}{extension}"
+
+
+# Renames the files of the presentation's own files folder to fingerprinted
+# names and rewrites the references in the stylesheets of the folder.
+# Returns the new names and the files to write, by name in the build.
+def fingerprint_files(path: str, ignore_patterns: List[str],
+                      exclude: Optional[str] = None) \
+        -> Tuple[Dict[str, str], Dict[str, bytes]]:
+    files_dir: str = os.path.join(path, "files")
+    if not os.path.isdir(files_dir):
+        return {}, {}
+    names: List[str] = [
+        x.replace(os.sep, "/") for x in tree_files(files_dir)
+        if not is_ignored(x, ignore_patterns)
+        and not is_inside(os.path.join(files_dir, x), exclude)]
+    contents: Dict[str, bytes] = {}
+    name: str
+    for name in names:
+        with open(os.path.join(files_dir, name), "rb") as f:
+            contents[name] = f.read()
+    renamed: Dict[str, str] = {}
+    # Stylesheets last, since their fingerprint depends on the names of the
+    # files they refer to
+    for name in sorted(names, key=lambda x: x.endswith(".css")):
+        content: bytes = contents[name]
+        if name.endswith(".css"):
+            text: str = content.decode("utf-8", errors="replace")
+            text = CSS_URL.sub(lambda x: rename_css_reference(
+                x, name, renamed), text)
+            content = contents[name] = minify_css(text).encode()
+        renamed[name] = fingerprinted_name(name, content)
+    return renamed, {"files/" + renamed[x]: contents[x] for x in names}
+
+
+# Whether `file` is the file or folder `folder`, or in it
+def is_inside(file: str, folder: Optional[str]) -> bool:
+    if folder is None:
+        return False
+    try:
+        relative: str = os.path.relpath(os.path.realpath(file),
+                                        os.path.realpath(folder))
+    except ValueError:  # On another drive
+        return False
+    return relative.split(os.sep)[0] != os.pardir
+
+
+# Raises RuntimeError if the build folder `output` of the presentation
+# `path` could cost the user files: the presentation itself, a folder with
+# the presentation in it, or a folder in it, or an existing folder that is
+# not empty and was not made by a build.
+def check_output(path: str, output: str) -> None:
+    if is_inside(path, output) or is_inside(output, path):
+        raise RuntimeError(f"the build would replace or be part of the "
+                           f"presentation: {output}")
+    if os.path.isdir(output) and os.listdir(output) \
+            and not os.path.isfile(os.path.join(output, BUILD_MARKER)):
+        raise RuntimeError(f"not replacing {output}, which is not empty and "
+                           f"was not made by a build")
+    if os.path.exists(output) and not os.path.isdir(output):
+        raise RuntimeError(f"not replacing the file {output}")
+
+
+# Rewrites the references to files/<name> in `text` to the new names
+def rename_references(text: str, renamed: Dict[str, str]) -> str:
+    if not renamed:
+        return text
+    reference: re.Pattern = re.compile(
+        r"(?<![\w/.-])(?:\./)?files/(" +
+        "|".join(re.escape(x) for x in sorted(renamed, key=len,
+                                              reverse=True)) +
+        r")(?![\w.-])")
+    return reference.sub(lambda x: "files/" + renamed[x.group(1)], text)
+
+
+# Gives the markdown files that slides load at runtime fingerprinted names,
+# after renaming their references to the files folder, and returns the
+# rewritten index.html and the files to write
+def fingerprint_slides(path: str, index_html: str, renamed: Dict[str, str]) \
+        -> Tuple[str, Dict[str, bytes]]:
+    slides: Dict[str, bytes] = {}
+
+    def rename(match: re.Match) -> str:
+        file: str = match.group(2)
+        if is_external(file) or not os.path.isfile(os.path.join(path, file)):
+            return match.group(0)
+        with open(os.path.join(path, file), encoding="utf-8",
+                  errors="replace") as f:
+            content: bytes = rename_references(f.read(), renamed).encode()
+        name: str = fingerprinted_name(file, content)
+        slides[name] = content
+        return match.group(1) + name + "\""
+
+    return MARKDOWN_REFERENCE.sub(rename, index_html), slides
+
+
+def rename_css_reference(match: re.Match, css_file: str,
+                         renamed: Dict[str, str]) -> str:
+    url: str = match.group(2)
+    if is_external(url):
+        return match.group(0)
+    target: str = posixpath.normpath(
+        posixpath.join(posixpath.dirname(css_file), url))
+    if target not in renamed:
+        return match.group(0)
+    return "url(" + posixpath.relpath(renamed[target],
+                                      posixpath.dirname(css_file) or ".") + \
+        ")"
+
+
+# index.html as refresh_template renders it, without writing it
+def render_index(path: str, template_name: str,
+                 reveal_specs:
+                 Optional[Dict[str, Dict[str, List[str]]]] = None,
+                 prerender: bool = False) -> str:
+    slide_cache: SlideCache = SlideCache(path, True, prerender)
+    slide_cache.sync()
+    settings: Dict[str, str] = index_settings(slide_cache, reveal_specs)
+    settings["slides"] = slide_cache.slides()
+    return load_template(template_name).render(settings)
+
+
+# Renders `path` once and writes the build to the folder `output`, or to
+# the zip file `output`, with ".zip" added unless it has it. Returns where
+# the build went. Raises RuntimeError for an output that check_output
+# refuses.
+def build(path: str, template_name: str, output: str, reveal_dir: str,
+          reveal_manifest: Dict[str, List[str]],
+          reveal_specs: Optional[Dict[str, Dict[str, List[str]]]] = None,
+          prerender: bool = False, ignore_patterns: List[str] = WATCH_IGNORE,
+          as_zip: bool = False) -> str:
+    zip_path: str = output if output.endswith(".zip") else output + ".zip"
+    if as_zip and os.path.isdir(zip_path):
+        raise RuntimeError(f"not replacing the folder {zip_path}")
+    if not as_zip:
+        check_output(path, output)
+    index_html: str = render_index(path, template_name, reveal_specs,
+                                   prerender)
+
+    # Tree-shake reveal.js to the files the rendered deck refers to
+    available: Set[str] = {x.replace(os.sep, "/")
+                           for x in runtime_files(reveal_dir,
+                                                  reveal_manifest)}
+    needed: List[str] = sorted(reveal_dependencies(index_html, reveal_dir,
+                                                   available))
+    # Stylesheets are minified, everything else is copied as it is
+    minified: Dict[str, bytes] = {}
+    hasher = hashlib.sha256()
+    file: str
+    for file in needed:
+        with open(os.path.join(reveal_dir, file), "rb") as f:
+            content: bytes = f.read()
+        if file.endswith(".css"):
+            content = minified[file] = \
+                minify_css(content.decode("utf-8", errors="replace")).encode()
+        hasher.update(file.encode() + b"\0" + content + b"\0")
+    # Plugins find their own files relative to their script, by name, so
+    # reveal.js keeps its layout and file names, and the fingerprint goes in
+    # the folder name instead.
+    assets: str = ASSETS_DIRECTORY + "/" + \
+        hasher.hexdigest()[:FINGERPRINT_LENGTH]
+    index_html = REVEAL_REFERENCE.sub(lambda x: assets + "/" + x.group(1),
+                                      index_html)
+
+    # An earlier zip in the files folder is not part of this build
+    renamed, own_files = fingerprint_files(path, ignore_patterns,
+                                           zip_path if as_zip else None)
+    index_html = rename_references(index_html, renamed)
+    index_html, slides = fingerprint_slides(path, index_html, renamed)
+    own_files.update(slides)
+    index_html = minify_html(index_html)
+
+    if as_zip:
+        temporary: str = zip_path + ".tmp"
+        with zipfile.ZipFile(temporary, "w", zipfile.ZIP_DEFLATED) as archive:
+            archive.writestr("index.html", index_html)
+            for file in needed:
+                if file in minified:
+                    archive.writestr(assets + "/" + file, minified[file])
+                else:
+                    archive.write(os.path.join(reveal_dir, file),
+                                  assets + "/" + file)
+            name: str
+            for name, content in sorted(own_files.items()):
+                archive.writestr(name, content)
+        os.replace(temporary, zip_path)
+        return zip_path
+
+    # Build next to the output and swap it in, so a failed build never
+    # leaves half a deck behind
+    parent: str = os.path.dirname(os.path.abspath(output))
+    os.makedirs(parent, exist_ok=True)
+    staging: str = tempfile.mkdtemp(prefix=".build.", dir=parent)
+    try:
+        with open(os.path.join(staging, "index.html"), "w",
+                  encoding="utf-8") as f:
+            f.write(index_html)
+        with open(os.path.join(staging, BUILD_MARKER), "w") as f:
+            f.write("Made by reveal launcher, replaced by the next build\n")
+        for file in needed:
+            target: str = os.path.join(staging, assets, file)
+            os.makedirs(os.path.dirname(target), exist_ok=True)
+            if file in minified:
+                with open(target, "wb") as f:
+                    f.write(minified[file])
+            else:
+                fast_copy(os.path.join(reveal_dir, file), target)
+        for name, content in own_files.items():
+            target = os.path.join(staging, name)
+            os.makedirs(os.path.dirname(target), exist_ok=True)
+            with open(target, "wb") as f:
+                f.write(content)
+        if os.path.isdir(output):
+            shutil.rmtree(output)
+        os.replace(staging, output)
+    except BaseException:
+        shutil.rmtree(staging, ignore_errors=True)
+        raise
+    return output
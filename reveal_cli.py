@@ -1,114 +1,711 @@
 #!/usr/bin/env python3
 
-import livereload
+import bisect
+import fnmatch
+import hashlib
 import os
 import jinja2
+import logging
+import platform
+import re
+import reveal_markdown
+import shutil
+import tempfile
 import threading
 import time
+import traceback
+import yaml
 #import socketserver
-from watchdog.observers import Observer
-from watchdog.events import FileSystemEventHandler
+from reveal_assets import cache_directory
+from reveal_timings import timings
+
+from typing import TYPE_CHECKING, Callable, Dict, Iterable, Iterator, \
+    List, NamedTuple, Optional, Set, TextIO, Tuple
+
+# Imported where they are used, since watchdog and the server (livereload,
+# tornado) take long to import and only serving needs them
+if TYPE_CHECKING:
+    from watchdog.events import FileSystemEvent
+    from watchdog.observers import Observer
+
+logger = logging.getLogger("reveal_launcher")
 
 PORT = 8000
 FOLDER = os.getcwd()
+# Quiet time in seconds after the last change, before refreshing
+REFRESH_DELAY = 0.1
+# Paths the watcher skips, in .gitignore style: a trailing "/" matches a
+# folder and everything in it, patterns without "/" match file names.
+WATCH_IGNORE = ["reveal.js/", "files/", "index.html",
+                "*.swp", "*.swx", "*~", ".#*", "#*#", "4913"]
 
+# One jinja2 Environment per template folder, so that every template is
+# compiled only once per process.
+TEMPLATE_ENVIRONMENTS: Dict[str, jinja2.Environment] = {}
+TEMPLATE_ENVIRONMENTS_LOCK: threading.Lock = threading.Lock()
 
-def refresh_template(template_name, running_refreshing, path):
-    if running_refreshing.is_set():
-        print("BUSY HERE!")
-        return
-    running_refreshing.set()
-    all_files = os.listdir(path)
-    content_files = [x for x in all_files if x != "index.html" and x.endswith(".html") or x.endswith(".md")]
-    content_files.sort()
 
-    settings = {}
+def template_environment(template_directory: str) -> jinja2.Environment:
+    with TEMPLATE_ENVIRONMENTS_LOCK:
+        environment: Optional[jinja2.Environment] = \
+            TEMPLATE_ENVIRONMENTS.get(template_directory)
+        if environment is None:
+            bytecode_directory: str = cache_directory("templates")
+            try:
+                os.makedirs(bytecode_directory, exist_ok=True)
+                bytecode_cache: Optional[jinja2.BytecodeCache] = \
+                    jinja2.FileSystemBytecodeCache(bytecode_directory)
+            except OSError:
+                print("cannot create template cache, compiling in memory")
+                bytecode_cache = None
+            # auto_reload recompiles a template only if its file changed
+            environment = jinja2.Environment(
+                loader=jinja2.FileSystemLoader(template_directory),
+                bytecode_cache=bytecode_cache,
+                auto_reload=True)
+            TEMPLATE_ENVIRONMENTS[template_directory] = environment
+    return environment
 
-    first_file = os.path.join(path, content_files[0])
-    with open(first_file) as f:
-        while True:
-            line = f.readline().strip()
-            if ":" in line:
-                key, var = line.split(":", maxsplit=1)
-                settings[key] = var.strip()
-            if line.startswith("-->"):
-                break
-
-    with open(template_name, 'r') as f:
-        lines = f.readlines()
-
-    slides = ""
-    for content_file in content_files:
-        content_file_full_path = os.path.join(path, content_file)
-        with open(content_file_full_path) as f:
-            content = "".join(f.readlines())
-        if content_file.endswith(".html"):
-            slides += content
+
+def load_template(template_file: str) -> jinja2.Template:
+    template_directory, template_name = \
+        os.path.split(os.path.abspath(template_file))
+    return template_environment(template_directory).get_template(
+        template_name)
+
+
+def is_content_file(file_name: str) -> bool:
+    return file_name != "index.html" and file_name.endswith(".html") \
+        or file_name.endswith(".md")
+
+
+def render_fragment(content_file: str, content: str,
+                    prerender: bool = False) -> str:
+    if content_file.endswith(".html"):
+        return content
+    if prerender:
+        return reveal_markdown.prerender(content)
+    return f"<section data-markdown=\"{content_file}\" data-separator=^\\r?\\n===\\r?\\n$ data-separator-vertical=^\\r?\\n---\\r?\\n$>\n" \
+        + content + "\n</section>\n"
+
+
+class Fragment(NamedTuple):
+    mtime: int
+    size: int
+    digest: str
+    content: str
+    block: str
+
+
+def parse_settings(lines: Iterable[str]) -> Dict[str, str]:
+    settings: Dict[str, str] = {}
+    line: str
+    for line in lines:
+        line = line.strip()
+        if ":" in line:
+            key, var = line.split(":", maxsplit=1)
+            settings[key] = var.strip()
+        if line.startswith("-->"):
+            break
+    return settings
+
+
+# Keeps the rendered <section> block of every content file in a folder.
+# Files are only re-read after a watchdog event marked them, and only
+# re-rendered if their content hash changed.
+# With keep_content=False only the hashes are kept and the slides are read
+# from disk while streaming, for decks too large to hold in memory.
+# With prerender=True markdown is rendered to HTML here instead of by the
+# RevealMarkdown plugin in the browser.
+class SlideCache:
+    def __init__(self, path: str, keep_content: bool = True,
+                 prerender: bool = False) -> None:
+        self.path: str = os.path.abspath(path)
+        self.keep_content: bool = keep_content
+        self.prerender: bool = prerender
+        self.fragments: Dict[str, Fragment] = {}
+        # Sorted file names, this is the order of the slides
+        self.order: List[str] = []
+        self.pending: Set[str] = set()
+        self.scanned: bool = False
+        # Hash of the last index.html written from these slides
+        self.output_digest: Optional[str] = None
+        self.lock: threading.Lock = threading.Lock()
+
+    def mark(self, file_path: str) -> bool:
+        file_path = os.path.abspath(file_path)
+        file_name: str = os.path.basename(file_path)
+        if os.path.dirname(file_path) != self.path \
+                or not is_content_file(file_name):
+            return False
+        with self.lock:
+            self.pending.add(file_name)
+        return True
+
+    def on_event(self, event: "FileSystemEvent") -> bool:
+        # Newer watchdog versions also report reading files, including our
+        # own reads while refreshing.
+        if event.is_directory \
+                or event.event_type in ("opened", "closed_no_write"):
+            return False
+        # Moves are a deletion of the source and a creation of the
+        # destination, so mark both.
+        changed: bool = self.mark(event.src_path)
+        dest_path: str = getattr(event, "dest_path", "")
+        if dest_path:
+            changed = self.mark(dest_path) or changed
+        return changed
+
+    def sync(self) -> Tuple[int, int]:
+        with timings.stage("refresh.list", deck=self.path):
+            with self.lock:
+                pending: Set[str] = self.pending
+                self.pending = set()
+                if not self.scanned:
+                    pending |= {x for x in os.listdir(self.path)
+                                if is_content_file(x)}
+                    self.scanned = True
+
+        reread: int = 0
+        with timings.stage("refresh.read", deck=self.path,
+                           files=len(pending)):
+            file_name: str
+            for file_name in pending:
+                reread += self.update(file_name)
+        return len(self.order) - reread, reread
+
+    def update(self, file_name: str) -> bool:
+        full_path: str = os.path.join(self.path, file_name)
+        old: Optional[Fragment] = self.fragments.get(file_name)
+        try:
+            stat: os.stat_result = os.stat(full_path)
+        except FileNotFoundError:
+            if old is not None:
+                del self.fragments[file_name]
+                self.order.remove(file_name)
+            return False
+        if old is not None and old.mtime == stat.st_mtime_ns \
+                and old.size == stat.st_size:
+            return False
+
+        with open(full_path) as f:
+            content: str = f.read()
+        digest: str = hashlib.sha1(content.encode()).hexdigest()
+        if old is None:
+            bisect.insort(self.order, file_name)
+        block: str = ""
+        if not self.keep_content:
+            content = ""
+        elif old is None or old.digest != digest:
+            block = render_fragment(file_name, content, self.prerender)
         else:
-            slides += f"<section data-markdown=\"{content_file}\" data-separator=^\\r?\\n===\\r?\\n$ data-separator-vertical=^\\r?\\n---\\r?\\n$>\n"
-            slides += content
-            slides += "\n</section>\n"
+            block = old.block
+        self.fragments[file_name] = \
+            Fragment(stat.st_mtime_ns, stat.st_size, digest, content, block)
+        return True
 
-    settings["slides"] = slides
+    def settings(self) -> Dict[str, str]:
+        if self.keep_content:
+            return parse_settings(
+                self.fragments[self.order[0]].content.splitlines())
+        f: TextIO
+        with open(os.path.join(self.path, self.order[0])) as f:
+            return parse_settings(f)
 
-    template = jinja2.Template("".join(lines))
-    rendered_template = template.render(settings)
+    def slides(self) -> str:
+        return "".join(self.blocks())
 
-    with open(os.path.join(path, "index.html"), 'w') as f:
-        f.write(rendered_template)
-    print("Template refreshed")
-    running_refreshing.clear()
+    def blocks(self) -> Iterator[str]:
+        file_name: str
+        for file_name in self.order:
+            if self.keep_content:
+                yield self.fragments[file_name].block
+            else:
+                f: TextIO
+                with open(os.path.join(self.path, file_name)) as f:
+                    yield render_fragment(file_name, f.read(),
+                                          self.prerender)
+
+
+# Scripts and stylesheets of the plugins enabled in the title slide, in the
+# order of reveal_specs, without duplicates
+def plugin_assets(settings: Dict[str, str],
+                  reveal_specs: Dict[str, Dict[str, List[str]]]) \
+        -> Tuple[List[str], List[str]]:
+    version: str = settings.get("version", "")
+    if version not in reveal_specs:
+        print(f"unknown reveal.js version \"{version}\", no plugins loaded")
+        return [], []
+    enabled: List[str] = [x.strip()
+                          for x in settings.get("plugins", "").split(",")
+                          if x.strip()]
+    plugin: str
+    for plugin in enabled:
+        if plugin not in reveal_specs[version]:
+            print(f"plugin {plugin} is not available for reveal.js "
+                  f"{version}")
+    assets: List[str] = []
+    plugin_files: List[str]
+    for plugin, plugin_files in reveal_specs[version].items():
+        if plugin in enabled:
+            assets += [x for x in plugin_files or [] if x not in assets]
+    return [x for x in assets if x.endswith(".js")], \
+        [x for x in assets if x.endswith(".css")]
 
-class Handler(FileSystemEventHandler):
-    def __init__(self, running_refreshing, template_name, path):
-        self.running_refreshing = running_refreshing
-        self.template_name = template_name
-        self.path = path
 
-    def on_any_event(self, event):
-        if not event.is_directory and \
-                (event.src_path.endswith(".md") \
-                or event.src_path.endswith(".html") \
-                and not event.src_path.endswith("index.html")):
-            refresh_template(self.template_name, self.running_refreshing,
-                             self.path)
-
-def watch_for_changes(path, template_name, running_watch, running_refreshing):
-    print("Running conversion once")
-    refresh_template(template_name, running_refreshing, path)
-    print("Watching for changes")
-    observer = Observer()
-    handler = Handler(running_refreshing, template_name, path)
-    observer.schedule(handler, path, recursive=True)
-    observer.start()
+# Stand-in for the slides while streaming, replaced by the slides one by one
+SLIDES_MARKER = "\x00slides\x00"
+
+
+def render_chunks(template: jinja2.Template, settings: Dict[str, str],
+                  slide_cache: SlideCache) -> Iterator[str]:
+    settings["slides"] = SLIDES_MARKER
+    chunk: str
+    for chunk in template.generate(settings):
+        if SLIDES_MARKER not in chunk:
+            yield chunk
+            continue
+        before, *rest = chunk.split(SLIDES_MARKER)
+        yield before
+        after: str
+        for after in rest:
+            yield from slide_cache.blocks()
+            yield after
+
+
+# Write to a temporary file first and rename it, so that the server never
+# sends a half-written file. Returns the hash of the content, or None if it
+# equals unchanged_digest and the file was left alone.
+def write_atomic(file_path: str, chunks: Iterable[str],
+                 unchanged_digest: Optional[str] = None) -> Optional[str]:
+    directory, file_name = os.path.split(os.path.abspath(file_path))
+    hasher = hashlib.sha1()
+    f: TextIO
+    with tempfile.NamedTemporaryFile("w", dir=directory, delete=False,
+                                     prefix="." + file_name + ".",
+                                     suffix=".tmp") as f:
+        chunk: str
+        for chunk in chunks:
+            hasher.update(chunk.encode())
+            f.write(chunk)
+    digest: str = hasher.hexdigest()
     try:
-        while running_watch.is_set():
-            time.sleep(1)
-    finally:
-        observer.stop()
-        observer.join()
+        if digest == unchanged_digest:
+            os.remove(f.name)
+            return None
+        if os.path.exists(file_path):
+            shutil.copymode(file_path, f.name)
+        else:
+            os.chmod(f.name, 0o644)
+        os.replace(f.name, file_path)
+    except OSError:
+        os.remove(f.name)
+        raise
+    return digest
+
+
+# Peak memory use of this process in MiB, None where it is not available
+def peak_rss() -> Optional[float]:
+    try:
+        import resource
+    except ImportError:  # Windows
+        return None
+    peak: int = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # Linux reports kilobytes, macOS bytes
+    return peak / (2**20 if platform.system() == "Darwin" else 2**10)
+
+
+# The template variables for the slides in `slide_cache`
+def index_settings(slide_cache, reveal_specs=None):
+    settings = slide_cache.settings()
+    if slide_cache.prerender and "plugins" in settings:
+        # There is no markdown left for the plugin to render
+        settings["plugins"] = ", ".join(
+            x.strip() for x in settings["plugins"].split(",")
+            if x.strip() != "RevealMarkdown")
+    if reveal_specs is not None:
+        settings["plugin_scripts"], settings["plugin_stylesheets"] = \
+            plugin_assets(settings, reveal_specs)
+    return settings
+
+
+# With an ImagePipeline, local images are replaced by their variants that are
+# ready, and the others are requested. `images_ready` is called once those
+# are ready too.
+def refresh_template(template_name, path, slide_cache=None, notify=None,
+                     stream=False, prerender=False, reveal_specs=None,
+                     images=None, images_ready=None):
+    start = time.perf_counter()
+    if slide_cache is None:
+        slide_cache = SlideCache(path, not stream, prerender)
+    reused, reread = slide_cache.sync()
+
+    settings = index_settings(slide_cache, reveal_specs)
+    template = load_template(template_name)
+    index_file = os.path.join(path, "index.html")
+
+    # Saving without changes, or only touching a file, must not cause a
+    # write and a reload.
+    if stream:
+        # Write the slides one by one, instead of rendering the whole deck
+        # into memory first.
+        chunks = render_chunks(template, settings, slide_cache)
+        if images is not None:
+            chunks = (images.rewrite(x, path, images_ready) for x in chunks)
+        if timings.enabled:
+            # Rendering happens while writing, so refresh.write includes
+            # it, and refresh.render is the time spent in the generator
+            chunks = timings.chunks("refresh.render", chunks,
+                                    deck=slide_cache.path)
+        with timings.stage("refresh.write", deck=slide_cache.path,
+                           stream=True):
+            digest = write_atomic(index_file, chunks,
+                                  slide_cache.output_digest)
+        logger.debug("peak memory use after streaming: %s MiB", peak_rss())
+    else:
+        with timings.stage("refresh.render", deck=slide_cache.path):
+            settings["slides"] = slide_cache.slides()
+            rendered_template = template.render(settings)
+            if images is not None:
+                rendered_template = images.rewrite(rendered_template, path,
+                                                   images_ready)
+        with timings.stage("refresh.write", deck=slide_cache.path):
+            digest = hashlib.sha1(rendered_template.encode()).hexdigest()
+            if digest == slide_cache.output_digest:
+                digest = None
+            else:
+                write_atomic(index_file, [rendered_template])
+        logger.debug("peak memory use after rendering: %s MiB", peak_rss())
+    if digest is None:
+        print(f"Template unchanged ({reused} reused, {reread} re-read)")
+        timings.record("refresh", time.perf_counter() - start,
+                       deck=slide_cache.path, reused=reused, reread=reread,
+                       changed=False)
+        return False
+    slide_cache.output_digest = digest
+    print(f"Template refreshed ({reused} reused, {reread} re-read)")
+    timings.record("refresh", time.perf_counter() - start,
+                   deck=slide_cache.path, reused=reused, reread=reread,
+                   changed=True)
+    if notify is not None:
+        notify("index.html")
+    return True
+
+
+# Collapses bursts of watchdog events into a single refresh. The refresh runs
+# on its own worker thread once no new request came in for `delay` seconds.
+# Requests that arrive while refreshing cause one more refresh afterwards,
+# so the last change is never lost. With a `stage` name, the time from the
+# first request to the end of the refresh goes to the timings.
+class RefreshScheduler:
+    def __init__(self, refresh: Callable[[], None],
+                 delay: float = REFRESH_DELAY,
+                 stage: Optional[str] = None) -> None:
+        self.refresh: Callable[[], None] = refresh
+        self.delay: float = delay
+        self.stage: Optional[str] = stage
+        self.condition: threading.Condition = threading.Condition()
+        # Time of the latest request, None if no refresh is pending
+        self.last_request: Optional[float] = None
+        # Time of the first request since the last refresh
+        self.first_request: Optional[float] = None
+        self.running: bool = False
+        self.worker: threading.Thread = \
+            threading.Thread(target=self.work, daemon=True)
+
+    def start(self) -> None:
+        self.running = True
+        self.worker.start()
+
+    def stop(self) -> None:
+        with self.condition:
+            self.running = False
+            self.condition.notify()
+        self.worker.join()
+
+    def request(self) -> None:
+        with self.condition:
+            self.last_request = time.monotonic()
+            if self.first_request is None:
+                self.first_request = self.last_request
+            self.condition.notify()
+
+    def work(self) -> None:
+        while True:
+            with self.condition:
+                while self.running and self.last_request is None:
+                    self.condition.wait()
+                while self.running:
+                    remaining: float = \
+                        self.last_request + self.delay - time.monotonic()
+                    if remaining <= 0:
+                        break
+                    self.condition.wait(remaining)
+                if not self.running:
+                    return
+                self.last_request = None
+                first_request: float = self.first_request
+                self.first_request = None
+            try:
+                self.refresh()
+            except Exception:
+                traceback.print_exc()
+            if self.stage is not None:
+                timings.record(self.stage, time.monotonic() - first_request)
+
+
+def is_ignored(relative_path: str, patterns: List[str]) -> bool:
+    parts: List[str] = relative_path.replace(os.sep, "/").split("/")
+    pattern: str
+    for pattern in patterns:
+        if pattern.endswith("/"):
+            if any(fnmatch.fnmatch(part, pattern[:-1]) for part in parts):
+                return True
+        elif "/" in pattern:
+            if fnmatch.fnmatch("/".join(parts), pattern.lstrip("/")):
+                return True
+        elif fnmatch.fnmatch(parts[-1], pattern):
+            return True
+    return False
+
+
+# Watchdog only calls dispatch() of its handlers, so they need not derive
+# from its FileSystemEventHandler
+class Handler:
+    def __init__(self, scheduler, slide_cache, path,
+                 ignore_patterns=WATCH_IGNORE):
+        self.scheduler = scheduler
+        self.slide_cache = slide_cache
+        self.path = os.path.abspath(path)
+        self.ignore_patterns = ignore_patterns
+
+    def ignored(self, file_path):
+        return is_ignored(
+            os.path.relpath(os.path.abspath(file_path), self.path),
+            self.ignore_patterns)
+
+    def dispatch(self, event):
+        if self.ignored(event.src_path) \
+                and self.ignored(getattr(event, "dest_path", "") or
+                                 event.src_path):
+            return
+        if self.slide_cache.on_event(event):
+            self.scheduler.request()
+
+# Sends changes of stylesheets and images in the files folder to the
+# browser, which can then update them without reloading the whole page.
+# `changed` is called with every changed file as well.
+class AssetHandler:
+    def __init__(self, path, notify, refresh_delay=REFRESH_DELAY,
+                 ignore_patterns=WATCH_IGNORE, changed=None):
+        self.path = os.path.abspath(path)
+        self.notify = notify
+        self.changed = changed
+        self.ignore_patterns = ignore_patterns
+        self.pending = set()
+        self.lock = threading.Lock()
+        self.scheduler = RefreshScheduler(self.send, refresh_delay)
+
+    def dispatch(self, event):
+        if event.is_directory \
+                or event.event_type in ("opened", "closed_no_write"):
+            return
+        file_path = getattr(event, "dest_path", "") or event.src_path
+        relative_path = \
+            os.path.relpath(os.path.abspath(file_path), self.path)
+        if is_ignored(os.path.basename(relative_path), self.ignore_patterns):
+            return
+        with self.lock:
+            self.pending.add(relative_path.replace(os.sep, "/"))
+        self.scheduler.request()
+        if self.changed is not None:
+            self.changed(relative_path.replace(os.sep, "/"))
+
+    def send(self):
+        with self.lock:
+            pending = self.pending
+            self.pending = set()
+        if self.notify is None:
+            return
+        for relative_path in sorted(pending):
+            self.notify(relative_path)
+
+
+# One presentation folder that is watched and rendered. The template can be
+# swapped while the session runs, which re-renders through the same
+# scheduler as file changes do.
+class WatchSession:
+    def __init__(self, path, template_name, refresh_delay=REFRESH_DELAY,
+                 ignore_patterns=WATCH_IGNORE, notify=None, stream=False,
+                 prerender=False, reveal_specs=None, images=None):
+        self.path = path
+        self.template_name = template_name
+        self.refresh_delay = refresh_delay
+        self.ignore_patterns = ignore_patterns
+        self.notify = notify
+        self.stream = stream
+        self.reveal_specs = reveal_specs
+        self.images = images
+        self.slide_cache = SlideCache(path, not stream, prerender)
+        self.scheduler = RefreshScheduler(self.refresh, refresh_delay,
+                                          "refresh.latency")
+
+    def refresh(self):
+        return refresh_template(self.template_name, self.path,
+                                self.slide_cache, self.notify, self.stream,
+                                reveal_specs=self.reveal_specs,
+                                images=self.images,
+                                images_ready=self.scheduler.request)
+
+    # index.html refers to image variants by the hash of the image, so a
+    # changed image needs a new index.html
+    def asset_changed(self, relative_path):
+        if self.images is not None and self.images.is_source(relative_path):
+            self.scheduler.request()
+
+    def set_template(self, template_name):
+        if template_name != self.template_name:
+            self.template_name = template_name
+            self.scheduler.request()
+
+    # Renders once, then watches with `observer` until stop()
+    def start(self, observer):
+        print("Running conversion once")
+        self.refresh()
+        print("Watching for changes")
+        self.scheduler.start()
+        handler = Handler(self.scheduler, self.slide_cache, self.path,
+                          self.ignore_patterns)
+        # Content files live in the presentation folder itself, so there is
+        # no need to watch the (large) reveal.js and files folders.
+        self.watches = [observer.schedule(handler, self.path,
+                                          recursive=False)]
+        self.asset_handler = None
+        files_path = os.path.join(self.path, "files")
+        if (self.notify is not None or self.images is not None) \
+                and os.path.isdir(files_path):
+            self.asset_handler = AssetHandler(self.path, self.notify,
+                                              self.refresh_delay,
+                                              self.ignore_patterns,
+                                              self.asset_changed)
+            self.asset_handler.scheduler.start()
+            self.watches.append(observer.schedule(self.asset_handler,
+                                                  files_path,
+                                                  recursive=True))
+
+    def stop(self, observer):
+        for watch in self.watches:
+            observer.unschedule(watch)
+        self.scheduler.stop()
+        if self.asset_handler is not None:
+            self.asset_handler.scheduler.stop()
         print("Stop watching")
 
 
+# Runs any number of watch sessions, one per presentation folder, on a
+# single watchdog observer. Sessions start and stop independently, and
+# stopping takes effect right away instead of at the next poll.
+class WatchController:
+    def __init__(self):
+        self.sessions: Dict[str, WatchSession] = {}
+        self.observer: Optional["Observer"] = None
+        self.lock: threading.Lock = threading.Lock()
+
+    # Replaces a running session for the same folder
+    def start(self, session: WatchSession) -> None:
+        key: str = os.path.abspath(session.path)
+        self.stop(key)
+        with self.lock, timings.stage("watch.start", deck=key):
+            if self.observer is None:
+                from watchdog.observers import Observer
+
+                self.observer = Observer()
+                self.observer.start()
+            try:
+                session.start(self.observer)
+            except BaseException:
+                # For example a template with a syntax error. Without other
+                # sessions, the observer would keep running for nothing.
+                if not self.sessions:
+                    self.observer.stop()
+                    self.observer.join()
+                    self.observer = None
+                raise
+            self.sessions[key] = session
+
+    def stop(self, path: str) -> None:
+        with self.lock:
+            session: Optional[WatchSession] = \
+                self.sessions.pop(os.path.abspath(path), None)
+            if session is None:
+                return
+            session.stop(self.observer)
+            if not self.sessions:
+                self.observer.stop()
+                self.observer.join()
+                self.observer = None
+
+    def stop_all(self) -> None:
+        path: str
+        for path in list(self.sessions):
+            self.stop(path)
+
+
+# Hosts several presentation folders on one server, each under its own URL
+# prefix. The decks share the server, the watchdog observer of `watches`
+# and the compiled templates, so each deck only adds its own content.
+class DeckHost:
+    def __init__(self, server, watches, **session_options):
+        self.server = server
+        self.watches = watches
+        # Passed on to every WatchSession
+        self.session_options = session_options
+        self.paths: Dict[str, str] = {}
+
+    # Returns the name of the deck, which is its URL prefix
+    def add(self, path: str, template_name: str) -> str:
+        name: str = re.sub(r"[^\w.-]", "-",
+                           os.path.basename(os.path.abspath(path))) or "deck"
+        base_name: str = name
+        number: int = 2
+        while name in self.paths:
+            name = f"{base_name}-{number}"
+            number += 1
+        self.paths[name] = path
+        self.watches.start(WatchSession(
+            path, template_name,
+            notify=lambda file_path: self.server.notify(file_path, name),
+            **self.session_options))
+        self.server.add_deck(name, path)
+        return name
+
+    def remove(self, name: str) -> None:
+        path: Optional[str] = self.paths.pop(name, None)
+        if path is not None:
+            self.server.remove_deck(name)
+            self.watches.stop(path)
+
+
 def main():
+    import reveal_server
+
     #server = http.server.HTTPServer(("", PORT), http.server.SimpleHTTPRequestHandler)
     path = "."
     template_name = "nlesc.template"
-    server = livereload.Server()
-    server.watch(path)
-
-    running_watch = threading.Event()
-    running_watch.set()
-
-    running_refreshing = threading.Event()
+    with open("config.yaml") as f:
+        config = yaml.safe_load(f)
+    server = reveal_server.Server(caching=config["http_caching"],
+                                  compression=config["http_compression"])
 
-    watching = threading.Thread(target=watch_for_changes,
-                                args=(path,
-                                      template_name,
-                                      running_watch,
-                                      running_refreshing),
-                                daemon=True)
-    watching.start()
+    watches = WatchController()
+    watches.start(WatchSession(path,
+                               template_name,
+                               config["refresh_delay"],
+                               config["watch_ignore"],
+                               reveal_server.ReloadNotifier(PORT),
+                               config["stream_render"],
+                               config["prerender_markdown"],
+                               config["reveal_specs"]))
     #serving = threading.Thread(target=server.serve_forever)
     #serving.start()
 
@@ -121,8 +718,7 @@ def main():
     finally:
         print()
         print("Stop serving")
-        running_watch.clear()
-        watching.join()
+        watches.stop_all()
         #server.shutdown()
         #serving.join()
 
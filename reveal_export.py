@@ -0,0 +1,401 @@
+#!/usr/bin/env python3
+
+# Exports a presentation folder to one self-contained .html file for talks
+# without a network: index.html rendered with the markdown prerendered, the
+# reveal.js stylesheets and scripts it uses inlined, and the files it refers
+# to embedded as data URIs. Processed files are cached by content hash, so
+# exporting again after a small edit only redoes what changed.
+
+import base64
+import concurrent.futures
+import hashlib
+import io
+import json
+import mimetypes
+import os
+import posixpath
+import re
+import tempfile
+import urllib.parse
+
+from reveal_assets import cache_directory
+from reveal_build import CSS_IMPORT, CSS_URL, HTML_STYLE, HTML_VERBATIM, \
+    is_external, minify_css, minify_html, render_index
+from reveal_cli import write_atomic
+from typing import Dict, List, Optional, Tuple
+
+try:
+    from PIL import Image
+except ImportError:
+    Image = None
+
+
+EXPORT_WORKERS: int = min(8, os.cpu_count() or 1)
+# Bump to invalidate the cache when the processing of files changes
+CACHE_VERSION: str = "1"
+# Larger images are scaled down, if Pillow is installed
+MAX_IMAGE_SIZE: int = 1920
+JPEG_QUALITY: int = 85
+
+HTML_STYLESHEET: re.Pattern = re.compile(
+    r"<link\b(?=[^>]*\brel=[\"']?stylesheet)[^>]*?\bhref=([\"'])([^\"']+)\1"
+    r"[^>]*>", re.IGNORECASE)
+HTML_SCRIPT: re.Pattern = re.compile(
+    r"<script\b([^>]*?)\bsrc=([\"'])([^\"']+)\2([^>]*)>\s*</script\s*>",
+    re.IGNORECASE)
+HTML_ID: re.Pattern = re.compile(r"\bid=([\"'])([^\"']+)\1")
+# Attributes that may refer to a file: src, href, poster and the data-
+# attributes of reveal.js, like data-background-image
+HTML_REFERENCE: re.Pattern = re.compile(
+    r"(\s(?:src|href|poster|data-[\w-]+)=)([\"'])([^\"'<>]+)\2")
+HTML_STYLE_ATTRIBUTE: re.Pattern = re.compile(r"(\sstyle=)([\"'])(.*?)\2")
+CSS_FONT_FACE: re.Pattern = re.compile(r"@font-face\s*{[^}]*}")
+CSS_SOURCE: re.Pattern = re.compile(r"\bsrc\s*:[^;}]*;?")
+CSS_FONT_FORMAT: re.Pattern = re.compile(
+    r"url\(\s*([\"']?)([^)\"']+)\1\s*\)(?:\s*format\(\s*[\"']?([\w-]+))?")
+# Font formats by preference; every browser that runs reveal.js 4 reads
+# woff2 or woff, so the others only make the file larger
+FONT_FORMATS: List[str] = ["woff2", "woff", "truetype", "opentype"]
+FONT_EXTENSIONS: Dict[str, str] = {".woff2": "woff2", ".woff": "woff",
+                                   ".ttf": "truetype", ".otf": "opentype"}
+SVG_PROLOG: re.Pattern = \
+    re.compile(r"<\?xml.*?\?>|<!DOCTYPE[^>]*>|<!--.*?-->", re.DOTALL)
+# Loads the files that plugins add to the page at runtime, like the menu
+# stylesheets, from data URIs instead of from next to the plugin script
+RUNTIME_FILES_LOADER: str = """<script>(function(files){
+var head=document.head,append=head.appendChild;
+head.appendChild=function(e){var a=e.tagName=="LINK"?"href":"src",u=e[a];
+if(u)for(var n in files)if(u.slice(-n.length-1)=="/"+n){e[a]=files[n];break}
+return append.call(head,e)}})(%s);</script>"""
+
+
+# Processed files on disk, by hash of how they were processed and of their
+# content. Safe to use from several threads.
+class ExportCache:
+    def __init__(self, directory: str) -> None:
+        self.directory: str = directory
+
+    @staticmethod
+    def key(kind: str, content: bytes) -> str:
+        return hashlib.sha256(f"{CACHE_VERSION}\0{kind}\0".encode() +
+                              content).hexdigest()
+
+    def get(self, key: str) -> Optional[str]:
+        try:
+            with open(os.path.join(self.directory, key[:2], key),
+                      encoding="ascii") as f:
+                return f.read()
+        except OSError:
+            return None
+
+    def put(self, key: str, value: str) -> None:
+        folder: str = os.path.join(self.directory, key[:2])
+        try:
+            os.makedirs(folder, exist_ok=True)
+            descriptor, temporary = tempfile.mkstemp(dir=folder)
+            with os.fdopen(descriptor, "w", encoding="ascii") as f:
+                f.write(value)
+            os.replace(temporary, os.path.join(folder, key))
+        except OSError as e:
+            # Only slower next time
+            print(f"could not cache {key}: {e}")
+
+
+def read_bytes(file: str) -> bytes:
+    with open(file, "rb") as f:
+        return f.read()
+
+
+def read_text(file: str) -> str:
+    with open(file, encoding="utf-8", errors="replace") as f:
+        return f.read()
+
+
+def mime_type(file: str) -> str:
+    extension: str = os.path.splitext(file)[1].lower()
+    if extension in FONT_EXTENSIONS:
+        return "font/" + {"truetype": "ttf", "opentype": "otf"}.get(
+            FONT_EXTENSIONS[extension], FONT_EXTENSIONS[extension])
+    return mimetypes.guess_type(file)[0] or "application/octet-stream"
+
+
+def minify_svg(text: str) -> str:
+    text = SVG_PROLOG.sub("", text)
+    text = re.sub(r">\s+<", "><", text)
+    return re.sub(r"\s+", " ", text).strip()
+
+
+# Re-encodes JPEG and PNG images, scaled down to MAX_IMAGE_SIZE, and keeps
+# the result if it is smaller. Without Pillow, images are left as they are.
+def optimize_image(content: bytes, mime: str) -> bytes:
+    if Image is None or mime not in ["image/jpeg", "image/png"]:
+        return content
+    try:
+        with Image.open(io.BytesIO(content)) as image:
+            if getattr(image, "is_animated", False):
+                return content
+            image.thumbnail((MAX_IMAGE_SIZE, MAX_IMAGE_SIZE))
+            output: io.BytesIO = io.BytesIO()
+            if mime == "image/jpeg":
+                image.save(output, "JPEG", quality=JPEG_QUALITY,
+                           optimize=True, progressive=True)
+            else:
+                image.save(output, "PNG", optimize=True)
+    except (OSError, ValueError) as e:
+        print(f"could not optimize image: {e}")
+        return content
+    return min(output.getvalue(), content, key=len)
+
+
+# Keeps a single source per @font-face rule: the local file in the format
+# browsers read best
+def prune_font_sources(css: str) -> str:
+    def prune(match: re.Match) -> str:
+        rule: str = match.group(0)
+        sources: List[Tuple[int, str, str]] = []
+        declaration: str
+        for declaration in CSS_SOURCE.findall(rule):
+            font: re.Match
+            for font in CSS_FONT_FORMAT.finditer(declaration):
+                url: str = font.group(2)
+                if is_external(url):
+                    return rule
+                font_format: str = font.group(3) or FONT_EXTENSIONS.get(
+                    posixpath.splitext(re.split(r"[?#]", url)[0])[1].lower(),
+                    "")
+                if font_format in FONT_FORMATS:
+                    sources.append((FONT_FORMATS.index(font_format), url,
+                                    font_format))
+        if not sources:
+            return rule
+        _, url, font_format = min(sources)
+        rule = CSS_SOURCE.sub("", rule)
+        return rule[:-1].rstrip().rstrip(";") + \
+            f";src:url({url}) format('{font_format}')}}"
+
+    return CSS_FONT_FACE.sub(prune, css)
+
+
+class Exporter:
+    def __init__(self, path: str, reveal_dir: str,
+                 cache: Optional[ExportCache] = None) -> None:
+        self.path: str = path
+        self.reveal_dir: str = reveal_dir
+        self.cache: Optional[ExportCache] = cache
+        # References that were left as they are, to report them once
+        self.external: List[str] = []
+
+    # The local file a URL in index.html refers to, or None. Presentations
+    # served with the reveal.js mount have no reveal.js folder of their own.
+    def resolve(self, url: str, base_dir: Optional[str] = None) \
+            -> Optional[str]:
+        if is_external(url) or ":" in url.split("/")[0]:
+            return None
+        url = urllib.parse.unquote(re.split(r"[?#]", url)[0])
+        if not url:
+            return None
+        file: str = os.path.normpath(os.path.join(base_dir or self.path, url))
+        if os.path.isfile(file):
+            return file
+        if base_dir is None:
+            match: Optional[re.Match] = re.match(r"(?:\./)?reveal\.js/(.+)",
+                                                 url)
+            if match:
+                file = os.path.join(self.reveal_dir,
+                                    *match.group(1).split("/"))
+                if os.path.isfile(file):
+                    return file
+        return None
+
+    def data_uri(self, file: str) -> str:
+        content: bytes = read_bytes(file)
+        mime: str = mime_type(file)
+        key: str = ""
+        if self.cache is not None:
+            key = self.cache.key("data:" + mime, content)
+            cached: Optional[str] = self.cache.get(key)
+            if cached is not None:
+                return cached
+        if mime == "text/css":
+            content = self.stylesheet(file).encode()
+        elif mime == "image/svg+xml":
+            content = minify_svg(content.decode("utf-8", errors="replace")) \
+                .encode()
+        else:
+            content = optimize_image(content, mime)
+        result: str = f"data:{mime};base64," + \
+            base64.b64encode(content).decode("ascii")
+        # Stylesheets depend on the files they refer to as well
+        if self.cache is not None and mime != "text/css":
+            self.cache.put(key, result)
+        return result
+
+    # `css` with its imports inlined, a single source per font, and the
+    # files it refers to as data URIs. URLs are relative to `base_dir`.
+    def inline_css(self, css: str, base_dir: str,
+                   importing: Tuple[str, ...] = ()) -> str:
+        def inline_import(match: re.Match) -> str:
+            file: Optional[str] = self.resolve(match.group(2), base_dir)
+            if file is None or file in importing:
+                return match.group(0)
+            return self.inline_css(read_text(file), os.path.dirname(file),
+                                   importing + (file,))
+
+        def inline_url(match: re.Match) -> str:
+            file: Optional[str] = self.resolve(match.group(2), base_dir)
+            if file is None:
+                return match.group(0)
+            return "url(" + self.data_uri(file) + ")"
+
+        # @import url(...) as well as @import "..."
+        css = re.sub(r"@import\s+url\(\s*([\"']?)([^)\"']+)\1\s*\)[^;]*;",
+                     inline_import, css)
+        css = re.sub(CSS_IMPORT.pattern + r"[^;]*;", inline_import, css)
+        css = prune_font_sources(css)
+        return CSS_URL.sub(inline_url, css)
+
+    def stylesheet(self, file: str) -> str:
+        return minify_css(self.inline_css(read_text(file),
+                                          os.path.dirname(file), (file,)))
+
+    def script(self, file: str) -> str:
+        # Would end the <script> element early
+        return re.sub(r"</(script)", r"<\\/\1", read_text(file),
+                      flags=re.IGNORECASE)
+
+    # Data URIs of the files a plugin script loads at runtime, by their
+    # path relative to the script: the stylesheets and scripts in the
+    # plugin folder that the script names
+    def runtime_files(self, script_file: str) -> Dict[str, str]:
+        folder: str = os.path.dirname(script_file)
+        if os.path.basename(folder) == "dist":
+            return {}
+        text: str = read_text(script_file)
+        files: Dict[str, str] = {}
+        root: str
+        names: List[str]
+        for root, _, names in os.walk(folder):
+            name: str
+            for name in names:
+                if not name.endswith((".css", ".js")):
+                    continue
+                file: str = os.path.join(root, name)
+                relative: str = os.path.relpath(file, folder).replace(
+                    os.sep, "/")
+                if file != script_file and \
+                        re.search(r"[\"']" + re.escape(relative) + r"[\"']",
+                                  text):
+                    files[relative] = self.data_uri(file)
+        return files
+
+    def export(self, index_html: str,
+               workers: int = EXPORT_WORKERS) -> str:
+        # Outside of elements, <script> or <style> elements, tag names
+        parts: List[str] = HTML_VERBATIM.split(index_html)
+        with concurrent.futures.ThreadPoolExecutor(workers) as pool:
+            stylesheets: Dict[str, concurrent.futures.Future] = {}
+            scripts: Dict[str, concurrent.futures.Future] = {}
+            runtime: Dict[str, concurrent.futures.Future] = {}
+            data_uris: Dict[str, concurrent.futures.Future] = {}
+            styles: Dict[int, concurrent.futures.Future] = {}
+            index: int
+            match: re.Match
+            file: Optional[str]
+            for index in range(0, len(parts), 3):
+                for match in HTML_STYLESHEET.finditer(parts[index]):
+                    file = self.resolve(match.group(2))
+                    if file is not None and file not in stylesheets:
+                        stylesheets[file] = pool.submit(self.stylesheet, file)
+                for match in HTML_REFERENCE.finditer(
+                        HTML_STYLESHEET.sub("", parts[index])):
+                    file = self.resolve(match.group(3))
+                    if file is not None and file not in data_uris:
+                        data_uris[file] = pool.submit(self.data_uri, file)
+                if index + 1 == len(parts):
+                    break
+                match = HTML_SCRIPT.fullmatch(parts[index + 1])
+                if match:
+                    file = self.resolve(match.group(3))
+                    if file is not None and file not in scripts:
+                        scripts[file] = pool.submit(self.script, file)
+                        runtime[file] = pool.submit(self.runtime_files, file)
+                elif parts[index + 2].lower() == "style":
+                    styles[index + 1] = pool.submit(
+                        HTML_STYLE.sub, lambda x: x.group(1) +
+                        self.inline_css(x.group(2), self.path) + x.group(3),
+                        parts[index + 1])
+
+            def inline_reference(match: re.Match) -> str:
+                file: Optional[str] = self.resolve(match.group(3))
+                if file is None or file not in data_uris:
+                    return match.group(0)
+                return match.group(1) + match.group(2) + \
+                    data_uris[file].result() + match.group(2)
+
+            def inline_stylesheet(match: re.Match) -> str:
+                file: Optional[str] = self.resolve(match.group(2))
+                if file is None:
+                    self.external.append(match.group(2))
+                    return match.group(0)
+                id_match: Optional[re.Match] = HTML_ID.search(match.group(0))
+                return ("<style>" if id_match is None else
+                        f"<style id=\"{id_match.group(2)}\">") + \
+                    stylesheets[file].result() + "</style>"
+
+            def inline_style_attribute(match: re.Match) -> str:
+                return match.group(1) + match.group(2) + \
+                    self.inline_css(match.group(3), self.path) + \
+                    match.group(2)
+
+            # Files that plugins load at runtime are handed to them by a
+            # loader in front of the first inlined script
+            files: Dict[str, str] = {}
+            future: concurrent.futures.Future
+            for future in runtime.values():
+                files.update(future.result())
+            loader: str = RUNTIME_FILES_LOADER % json.dumps(files) \
+                if files else ""
+
+            result: List[str] = []
+            for index in range(0, len(parts), 3):
+                outside: str = HTML_REFERENCE.sub(inline_reference,
+                                                  parts[index])
+                outside = HTML_STYLESHEET.sub(inline_stylesheet, outside)
+                result.append(HTML_STYLE_ATTRIBUTE.sub(inline_style_attribute,
+                                                       outside))
+                if index + 1 == len(parts):
+                    break
+                element: str = parts[index + 1]
+                match = HTML_SCRIPT.fullmatch(element)
+                if match:
+                    file = self.resolve(match.group(3))
+                    if file is None:
+                        self.external.append(match.group(3))
+                    else:
+                        element = f"<script{match.group(1)}" \
+                            f"{match.group(4)}>" + scripts[file].result() + \
+                            "</script>"
+                        element, loader = loader + element, ""
+                elif index + 1 in styles:
+                    element = styles[index + 1].result()
+                result.append(element)
+        return minify_html("".join(result))
+
+
+# Renders `path` and writes it to the single file `output`. Returns the
+# references that could not be inlined, like stylesheets on other sites.
+def export(path: str, template_name: str, output: str, reveal_dir: str,
+           reveal_specs: Optional[Dict[str, Dict[str, List[str]]]] = None,
+           use_cache: bool = True) -> List[str]:
+    # Prerendered, since the markdown plugin can not load the slides from
+    # their files without a web server
+    index_html: str = render_index(path, template_name, reveal_specs,
+                                   prerender=True)
+    exporter: Exporter = Exporter(
+        path, reveal_dir,
+        ExportCache(cache_directory("export")) if use_cache else None)
+    exported: str = exporter.export(index_html)
+
+    os.makedirs(os.path.dirname(os.path.abspath(output)), exist_ok=True)
+    write_atomic(output, [exported])
+    return exporter.external
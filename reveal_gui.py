@@ -4,7 +4,7 @@ import os
 import tkinter as tk
 import webbrowser
 
-from typing import Dict, List, TextIO, Union
+from typing import Dict, List, Optional, Set, TextIO, Union
 from tkinter import ttk, filedialog
 from _tkinter import Tcl_Obj
 # TODO why is this commented out? Nuitka issue maybe?
@@ -22,15 +22,16 @@ ALL_PLUGINS: Dict[str, str] = \
         "RevealZoom": "zoom description",
     }
 
-# Configure available versions (keys) and plugins (values)
-# that are implemented for this version.
-REVEAL_SPECS: Dict[str, List[str]] = \
-    {"4.3.0": ["RevealZoom"],
-     "4.3.1": ["RevealZoom",
-               "RevealNotes",
-               "RevealSearch",
-               "RevealMarkdown",
-               "RevealHighlight"],
+# Configure available versions (keys) and the plugins that are implemented
+# for each version, with their files, like reveal_specs in config.yaml. The
+# window only needs the plugin names.
+REVEAL_SPECS: Dict[str, Dict[str, List[str]]] = \
+    {"4.3.0": {"RevealZoom": []},
+     "4.3.1": {"RevealZoom": [],
+               "RevealNotes": [],
+               "RevealSearch": [],
+               "RevealMarkdown": [],
+               "RevealHighlight": []},
      }
 
 
@@ -49,7 +50,7 @@ class Gui(ttk.Frame):
         self.default_port: str = "8000"
         self.warning_color: str = WARNING_COLOR
         self.all_plugins: Dict[str, str] = ALL_PLUGINS
-        self.reveal_specs: Dict[str, str] = REVEAL_SPECS
+        self.reveal_specs: Dict[str, Dict[str, List[str]]] = REVEAL_SPECS
 
         # Follow roughly the Golden Ratio for x- and y-padding.
         self.padx: float = 30.  # horizontal
@@ -120,7 +121,9 @@ class Gui(ttk.Frame):
         self.all_plugins = all_plugins
         self.refresh_plugin_checkboxes()
 
-    def set_reveal_specs(self, reveal_specs: Dict[str, List[str]]) -> None:
+    def set_reveal_specs(self,
+                         reveal_specs: Dict[str, Dict[str, List[str]]]) \
+            -> None:
         self.reveal_specs = reveal_specs
         self.refresh_versions()
 
@@ -139,7 +142,7 @@ class Gui(ttk.Frame):
                                 text=version,
                                 value=version,
                                 variable=self.active_reveal_version,
-                                command=self.refresh_plugin_checkbox_states))
+                                command=self.change_version))
         index: int
         version_button: ttk.Radiobutton
         for index, version_button in \
@@ -171,7 +174,8 @@ class Gui(ttk.Frame):
             plugin_checkbox: ttk.Checkbutton = \
                 ttk.Checkbutton(self.plugins_frame,
                                 text=plugin,
-                                variable=self.plugins_chosen[plugin])
+                                variable=self.plugins_chosen[plugin],
+                                command=self.refresh_server)
             self.plugin_checkboxes.append(plugin_checkbox)
             self.plugins_frame.rowconfigure(index=index, weight=1)
             plugin_checkbox.grid(row=index, column=0, sticky="we")
@@ -200,6 +204,9 @@ class Gui(ttk.Frame):
         def refresh_metadata(self):
             print("refreshing metadata")
 
+        def reconfigure(self):
+            print("reconfigure")
+
     def refresh_plugin_checkboxes(self) -> None:
         plugin_checkbox: ttk.Checkbutton
         for plugin_checkbox in self.plugin_checkboxes:
@@ -207,9 +214,13 @@ class Gui(ttk.Frame):
         self.plugin_checkboxes.clear()
         self.draw_plugin_checkboxes()
 
+    def change_version(self) -> None:
+        self.refresh_plugin_checkbox_states()
+        self.refresh_server()
+
     def refresh_plugin_checkbox_states(self) -> None:
-        available_plugins: List[str] = \
-            self.reveal_specs[self.active_reveal_version.get()]
+        available_plugins: Set[str] = \
+            set(self.reveal_specs[self.active_reveal_version.get()].keys())
         plugin_checkbox: ttk.Checkbutton
         for plugin_checkbox in self.plugin_checkboxes:
             plugin_text: str = plugin_checkbox.cget("text")
@@ -225,6 +236,17 @@ class Gui(ttk.Frame):
     def use(self) -> None:
         self.state.set("serving")
 
+    # Shows what is being done on the disabled "Run" button, or restores the
+    # button for None.
+    def show_progress(self, text: Optional[str]) -> None:
+        if text is None:
+            self.use_button.configure(text="Run")
+            if self.state.get() != "invalid path":
+                self.use_button.state(["!disabled"])
+        else:
+            self.use_button.configure(text=text)
+            self.use_button.state(["disabled"])
+
     def check_path_validity(self, *args: str) -> None:
         if os.path.isdir(self.presentation_path.get()):
             self.state.set("valid path")
@@ -272,8 +294,11 @@ class Gui(ttk.Frame):
         webbrowser.open_new_tab(
             self.base_url.get() + ":" + str(self.port.get()))
 
+    # Apply the chosen template, version and plugins to the running
+    # presentation
     def refresh_server(self) -> None:
-        pass
+        if self.state.get() == "serving":
+            self.logic.reconfigure()
 
     def update_url(self, *args: str) -> None:
         #  Disable the url button in case there is _no_ port defined.
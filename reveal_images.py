@@ -0,0 +1,338 @@
+#!/usr/bin/env python3
+
+# Serves downscaled, re-encoded copies of the images that slides refer to,
+# so that browsers download the size they show instead of the original.
+# Rendered HTML gets <picture> elements with AVIF and WebP sources and a
+# srcset on the <img>. The copies (variants) are made by a process pool
+# and kept in the user cache folder by a hash of the original, and index.html
+# only refers to variants that are ready, so refreshing never waits for
+# them. Needs Pillow; without it, images are served as they are.
+
+import concurrent.futures
+import hashlib
+import json
+import os
+import re
+import shutil
+import threading
+import time
+import traceback
+import urllib.parse
+
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+try:
+    from PIL import Image, ImageOps, features
+except ImportError:
+    Image = None
+
+
+# URL prefix the server mounts the variants folder at
+IMAGE_MOUNT: str = "_images"
+IMAGE_WIDTHS: List[int] = [640, 1280, 1920]
+IMAGE_EXTENSIONS: List[str] = [".jpg", ".jpeg", ".png"]
+MANIFEST_NAME: str = "variants.json"
+# Variants that were not used for this many days are removed when the
+# pipeline shuts down, so the cache does not keep the variants of images
+# that changed or of decks that are gone
+IMAGE_CACHE_DAYS: int = 30
+# Pillow save() options by format. AVIF is slow to encode; speed 8 takes a
+# third of the default time for files a few percent larger.
+ENCODER_OPTIONS: Dict[str, Dict[str, Any]] = {
+    "AVIF": {"quality": 60, "speed": 8},
+    "WEBP": {"quality": 80},
+    "JPEG": {"quality": 85, "optimize": True, "progressive": True},
+    "PNG": {"optimize": True}}
+# Pillow format, MIME type and file extension, the preferred format first
+MODERN_FORMATS: List[Tuple[str, str, str]] = [("AVIF", "image/avif", "avif"),
+                                              ("WEBP", "image/webp", "webp")]
+
+HTML_IMAGE: re.Pattern = re.compile(r"<img\b[^>]*>", re.IGNORECASE)
+HTML_SRC: re.Pattern = re.compile(r"\ssrc=([\"'])([^\"']+)\1")
+HTML_CLASS: re.Pattern = re.compile(r"\sclass=([\"'])([^\"']*)\1")
+HTML_BACKGROUND: re.Pattern = \
+    re.compile(r"(\sdata-background-image=)([\"'])([^\"']+)\2")
+
+# Description of the variants of one image, as in its variants.json: the
+# width, height and size in bytes of the original and a list of variants,
+# each with "width", "type", "file" and "size"
+Manifest = Dict[str, Any]
+
+
+# The modern formats the installed Pillow can write
+def modern_formats() -> List[Tuple[str, str, str]]:
+    if Image is None:
+        return []
+    return [x for x in MODERN_FORMATS if features.check(x[2])]
+
+
+def save(image: "Image.Image", file: str, image_format: str) -> int:
+    if image_format == "JPEG" and image.mode not in ["RGB", "L"]:
+        image = image.convert("RGB")
+    image.save(file, image_format, **ENCODER_OPTIONS[image_format])
+    return os.path.getsize(file)
+
+
+# Runs in a worker process. Writes the variants of `source` to the folder
+# `target`, which appears at once and complete, and returns its manifest.
+def make_variants(source: str, target: str, widths: List[int],
+                  formats: List[Tuple[str, str, str]]) -> Manifest:
+    staging: str = f"{target}.{os.getpid()}.tmp"
+    os.makedirs(staging, exist_ok=True)
+    try:
+        with Image.open(source) as original:
+            fallback: Tuple[str, str, str] = \
+                ("JPEG", "image/jpeg", "jpg") if original.format == "JPEG" \
+                else ("PNG", "image/png", "png")
+            image: Image.Image = ImageOps.exif_transpose(original)
+            image.load()
+        manifest: Manifest = {"width": image.width, "height": image.height,
+                              "size": os.path.getsize(source),
+                              "variants": []}
+        width: int
+        for width in sorted(set(widths) | {image.width}):
+            if width > image.width:
+                continue
+            resized: Image.Image = image if width == image.width else \
+                image.resize((width, max(1, round(image.height * width /
+                                                  image.width))),
+                             Image.LANCZOS)
+            # The original is the fallback at full size
+            image_format: str
+            mime_type: str
+            extension: str
+            for image_format, mime_type, extension in \
+                    formats + ([fallback] if width < image.width else []):
+                name: str = f"{width}.{extension}"
+                manifest["variants"].append({
+                    "width": width, "type": mime_type, "file": name,
+                    "size": save(resized, os.path.join(staging, name),
+                                 image_format)})
+        with open(os.path.join(staging, MANIFEST_NAME), "w") as f:
+            json.dump(manifest, f)
+        try:
+            os.replace(staging, target)
+        except OSError:
+            # Made by another process in the meantime
+            if not os.path.isfile(os.path.join(target, MANIFEST_NAME)):
+                raise
+    finally:
+        shutil.rmtree(staging, ignore_errors=True)
+    return manifest
+
+
+class ImagePipeline:
+    def __init__(self, directory: str, widths: List[int] = IMAGE_WIDTHS,
+                 workers: Optional[int] = None) -> None:
+        self.directory: str = directory
+        self.widths: List[int] = widths
+        self.workers: Optional[int] = workers
+        self.formats: List[Tuple[str, str, str]] = modern_formats()
+        # Part of the folder name of the variants, since they depend on the
+        # widths and formats as well as on the image
+        self.settings_digest: str = hashlib.sha256(
+            json.dumps([widths, self.formats, ENCODER_OPTIONS]).encode()) \
+            .hexdigest()[:8]
+        self.pool: Optional[concurrent.futures.ProcessPoolExecutor] = None
+        self.lock: threading.Lock = threading.Lock()
+        # Content hashes by file, with the modification time and size they
+        # were computed for
+        self.digests: Dict[str, Tuple[int, int, str]] = {}
+        # Manifests by content hash, None for images that failed
+        self.manifests: Dict[str, Optional[Manifest]] = {}
+        # Callbacks by content hash of the images being made
+        self.pending: Dict[str, List[Callable[[], None]]] = {}
+
+    @staticmethod
+    def available() -> bool:
+        return Image is not None
+
+    # Whether the pipeline makes variants of `file`
+    @staticmethod
+    def is_source(file: str) -> bool:
+        return os.path.splitext(file)[1].lower() in IMAGE_EXTENSIONS
+
+    def digest(self, file: str) -> Optional[str]:
+        try:
+            stat: os.stat_result = os.stat(file)
+        except OSError:
+            return None
+        with self.lock:
+            known: Optional[Tuple[int, int, str]] = self.digests.get(file)
+        if known is not None and known[:2] == (stat.st_mtime_ns,
+                                               stat.st_size):
+            return known[2]
+        hasher = hashlib.sha256()
+        with open(file, "rb") as f:
+            for block in iter(lambda: f.read(2**20), b""):
+                hasher.update(block)
+        digest: str = hasher.hexdigest()[:32]
+        with self.lock:
+            self.digests[file] = (stat.st_mtime_ns, stat.st_size, digest)
+        return digest
+
+    # The manifest of the image at `url`, relative to the presentation
+    # folder `path`, or None if it has no variants (yet). Missing variants
+    # are made in the background, and `ready` is called when they are.
+    def lookup(self, url: str, path: str,
+               ready: Optional[Callable[[], None]] = None) \
+            -> Optional[Tuple[str, Manifest]]:
+        if re.match(r"^[\w+.-]*:|^//|^#", url):
+            return None
+        url = urllib.parse.unquote(re.split(r"[?#]", url)[0])
+        if not self.is_source(url):
+            return None
+        file: str = os.path.normpath(os.path.join(path, url))
+        if os.path.relpath(file, path).startswith(os.pardir):
+            return None
+        content_digest: Optional[str] = self.digest(file)
+        if content_digest is None:
+            return None
+        digest: str = content_digest + "-" + self.settings_digest
+        target: str = os.path.join(self.directory, digest)
+        with self.lock:
+            if digest in self.manifests:
+                manifest: Optional[Manifest] = self.manifests[digest]
+                return None if manifest is None else (digest, manifest)
+            if digest in self.pending:
+                if ready is not None:
+                    self.pending[digest].append(ready)
+                return None
+            try:
+                with open(os.path.join(target, MANIFEST_NAME)) as f:
+                    manifest = self.manifests[digest] = json.load(f)
+                # Marks the variants as used, see prune()
+                os.utime(os.path.join(target, MANIFEST_NAME))
+                return digest, manifest
+            except (OSError, ValueError):
+                pass
+            self.pending[digest] = [] if ready is None else [ready]
+            if self.pool is None:
+                # Not forked: the server and the watchers run threads,
+                # which do not survive a fork
+                import multiprocessing
+
+                self.pool = concurrent.futures.ProcessPoolExecutor(
+                    self.workers, multiprocessing.get_context("spawn"))
+            os.makedirs(self.directory, exist_ok=True)
+            future: concurrent.futures.Future = self.pool.submit(
+                make_variants, file, target, self.widths, self.formats)
+        future.add_done_callback(lambda x: self.finish(digest, x))
+        return None
+
+    def finish(self, digest: str, future: concurrent.futures.Future) -> None:
+        manifest: Optional[Manifest] = None
+        if not future.cancelled():
+            try:
+                manifest = future.result()
+            except Exception:
+                traceback.print_exc()
+        with self.lock:
+            self.manifests[digest] = manifest
+            callbacks: List[Callable[[], None]] = self.pending.pop(digest, [])
+        if manifest is None:
+            return
+        callback: Callable[[], None]
+        for callback in callbacks:
+            callback()
+
+    @staticmethod
+    def srcset(digest: str, manifest: Manifest, mime_type: str,
+               original: Optional[str] = None) -> str:
+        candidates: List[str] = [
+            f"{IMAGE_MOUNT}/{digest}/{x['file']} {x['width']}w"
+            for x in manifest["variants"] if x["type"] == mime_type]
+        if original is not None:
+            # Spaces and commas separate the candidates of a srcset
+            candidates.append(
+                f"{urllib.parse.quote(original, safe='/%:@')} "
+                f"{manifest['width']}w")
+        return ", ".join(candidates)
+
+    # `html` with its local images replaced by their variants, where those
+    # are ready. Calls `ready` once more variants are ready.
+    def rewrite(self, html: str, path: str,
+                ready: Optional[Callable[[], None]] = None) -> str:
+        def image(match: re.Match) -> str:
+            tag: str = match.group(0)
+            src: Optional[re.Match] = HTML_SRC.search(tag)
+            if src is None or re.search(r"\ssrcset=", tag, re.IGNORECASE) \
+                    or html.rfind("<picture", 0, match.start()) > \
+                    html.rfind("</picture", 0, match.start()):
+                return tag
+            found: Optional[Tuple[str, Manifest]] = \
+                self.lookup(src.group(2), path, ready)
+            if found is None:
+                return tag
+            digest, manifest = found
+            end: int = len(tag) - (2 if tag.endswith("/>") else 1)
+            fallback: str = next(
+                (x["type"] for x in manifest["variants"]
+                 if x["type"] not in [y[1] for y in MODERN_FORMATS]), "")
+            if any(x["type"] == fallback for x in manifest["variants"]):
+                tag = tag[:end].rstrip() + " srcset=\"" + self.srcset(
+                    digest, manifest, fallback, src.group(2)) + "\"" + \
+                    tag[end:]
+            # reveal.js only stretches elements that are direct children of
+            # the slide
+            classes: Optional[re.Match] = HTML_CLASS.search(tag)
+            if classes and {"r-stretch", "stretch"} & \
+                    set(classes.group(2).split()):
+                return tag
+            sources: str = "".join(
+                f"<source type=\"{x[1]}\" srcset=\""
+                f"{self.srcset(digest, manifest, x[1])}\">"
+                for x in MODERN_FORMATS
+                if any(y["type"] == x[1] for y in manifest["variants"]))
+            return f"<picture>{sources}{tag}</picture>"
+
+        # Background images have no srcset or fallbacks. They get the full
+        # size WebP variant, which every browser reveal.js 4 runs on reads,
+        # if it is smaller than the original.
+        def background(match: re.Match) -> str:
+            found: Optional[Tuple[str, Manifest]] = \
+                self.lookup(match.group(3), path, ready)
+            if found is None:
+                return match.group(0)
+            digest, manifest = found
+            variant: Optional[Dict[str, Any]] = next(
+                (x for x in manifest["variants"]
+                 if x["width"] == manifest["width"]
+                 and x["type"] == "image/webp"
+                 and x["size"] < manifest["size"]), None)
+            if variant is None:
+                return match.group(0)
+            return match.group(1) + match.group(2) + \
+                f"{IMAGE_MOUNT}/{digest}/{variant['file']}" + match.group(2)
+
+        html = HTML_IMAGE.sub(image, html)
+        return HTML_BACKGROUND.sub(background, html)
+
+    # Removes the variants that were not used for `days` days, and what
+    # interrupted workers left behind
+    def prune(self, days: int = IMAGE_CACHE_DAYS) -> None:
+        oldest: float = time.time() - days * 24 * 60 * 60
+        try:
+            names: List[str] = os.listdir(self.directory)
+        except OSError:
+            return
+        name: str
+        for name in names:
+            folder: str = os.path.join(self.directory, name)
+            try:
+                used: float = os.path.getmtime(
+                    folder if name.endswith(".tmp")
+                    else os.path.join(folder, MANIFEST_NAME))
+            except OSError:
+                used = 0
+            if used < oldest:
+                shutil.rmtree(folder, ignore_errors=True)
+
+    def shutdown(self) -> None:
+        with self.lock:
+            pool: Optional[concurrent.futures.ProcessPoolExecutor] = \
+                self.pool
+            self.pool = None
+        if pool is not None:
+            pool.shutdown(wait=False, cancel_futures=True)
+        self.prune()
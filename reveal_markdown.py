@@ -0,0 +1,252 @@
+#!/usr/bin/env python3
+
+# Renders markdown slides to HTML the way the RevealMarkdown plugin
+# (reveal.js/<version>/reveal.js/plugin/markdown/plugin.js) does it in the
+# browser, so the browser gets ready-made <section> elements.
+
+import hashlib
+import html
+import html.parser
+import markdown
+import re
+import threading
+
+from markdown.extensions import Extension
+from markdown.preprocessors import Preprocessor
+from typing import Dict, List, Optional, Tuple, Union
+
+
+HORIZONTAL_SEPARATOR: str = r"^\r?\n===\r?\n$"
+VERTICAL_SEPARATOR: str = r"^\r?\n---\r?\n$"
+NOTES_SEPARATOR: str = r"notes?:"
+ELEMENT_ATTRIBUTES: str = r"\.element\s*?(.+?)$"
+SLIDE_ATTRIBUTES: str = r"\.slide:\s*?(\S.+?)$"
+ATTRIBUTE: re.Pattern = \
+    re.compile(r"([^\"= ]+?)=\"([^\"]+?)\"|(data-[^\"= ]+?)(?=[\" ])")
+CODE_LINE_NUMBERS: re.Pattern = re.compile(r"\[([\s\d,|-]*)\]")
+FENCED_CODE: re.Pattern = \
+    re.compile(r"^(?P<fence>`{3,}|~{3,})[ \t]*(?P<language>[^\n`]*)\n"
+               r"(?P<code>.*?)\n?^(?P=fence)[ \t]*$",
+               re.MULTILINE | re.DOTALL)
+# Elements without a closing tag
+VOID_ELEMENTS: List[str] = ["area", "base", "br", "col", "embed", "hr", "img",
+                            "input", "link", "meta", "source", "track", "wbr"]
+MARKDOWN_EXTENSIONS: List[str] = ["tables", "sane_lists"]
+
+# Rendered markdown files by content hash
+CACHE_SIZE: int = 1024
+CACHE: Dict[str, str] = {}
+CACHE_LOCK: threading.Lock = threading.Lock()
+
+Attributes = Dict[str, Optional[str]]
+
+
+# Fenced code blocks as rendered by the plugin: escaped, with the language as
+# class and optional line numbers, as in ```python [1,4-8]
+class FencedCodePreprocessor(Preprocessor):
+    def run(self, lines: List[str]) -> List[str]:
+        def replace(match: re.Match) -> str:
+            language: str = match.group("language").strip()
+            line_numbers: str = ""
+            numbers_match: Optional[re.Match] = \
+                CODE_LINE_NUMBERS.search(language)
+            if numbers_match:
+                line_numbers = \
+                    f"data-line-numbers=\"{numbers_match.group(1).strip()}\""
+                language = CODE_LINE_NUMBERS.sub("", language).strip()
+            code: str = html.escape(match.group("code"))
+            return "\n" + self.md.htmlStash.store(
+                f"<pre><code {line_numbers} class=\"{language}\">"
+                f"{code}</code></pre>") + "\n"
+
+        return FENCED_CODE.sub(replace, "\n".join(lines)).split("\n")
+
+
+class FencedCodeExtension(Extension):
+    def extendMarkdown(self, md: markdown.Markdown) -> None:
+        md.preprocessors.register(FencedCodePreprocessor(md),
+                                  "reveal_fenced_code", 30)
+
+
+def to_html(text: str) -> str:
+    return markdown.markdown(
+        text, extensions=MARKDOWN_EXTENSIONS + [FencedCodeExtension()])
+
+
+def parse_attributes(text: str) -> List[Tuple[str, Optional[str]]]:
+    return [(match.group(1), match.group(2)) if match.group(2)
+            else (match.group(3), "")
+            for match in ATTRIBUTE.finditer(text)]
+
+
+class Element:
+    def __init__(self, tag: str, attributes: Attributes,
+                 span: Tuple[int, int]) -> None:
+        self.tag: str = tag
+        self.attributes: Attributes = attributes
+        self.span: Tuple[int, int] = span
+        self.changed: bool = False
+        self.last_child: Optional["Element"] = None
+
+
+# Applies <!-- .element: ... --> comments to the previous sibling element,
+# or to the parent element if there is none, and <!-- .slide: ... -->
+# comments to the slide itself.
+class AttributeParser(html.parser.HTMLParser):
+    def __init__(self, text: str, slide: Element) -> None:
+        super().__init__(convert_charrefs=False)
+        self.text: str = text
+        self.line_offsets: List[int] = [0]
+        line: str
+        for line in text.splitlines(keepends=True):
+            self.line_offsets.append(self.line_offsets[-1] + len(line))
+        self.slide: Element = slide
+        self.stack: List[Element] = [slide]
+        self.elements: List[Element] = []
+
+    def position(self) -> int:
+        line, column = self.getpos()
+        return self.line_offsets[line - 1] + column
+
+    def handle_starttag(self, tag: str,
+                        attrs: List[Tuple[str, Optional[str]]]) -> None:
+        start: int = self.position()
+        element: Element = Element(
+            tag, dict(attrs),
+            (start, start + len(self.get_starttag_text())))
+        self.elements.append(element)
+        if tag in VOID_ELEMENTS:
+            self.add_child(element)
+        else:
+            self.stack.append(element)
+
+    def handle_startendtag(self, tag: str,
+                           attrs: List[Tuple[str, Optional[str]]]) -> None:
+        self.handle_starttag(tag, attrs)
+        if tag not in VOID_ELEMENTS:
+            self.add_child(self.stack.pop())
+
+    def handle_endtag(self, tag: str) -> None:
+        if tag in VOID_ELEMENTS \
+                or tag not in [x.tag for x in self.stack[1:]]:
+            return
+        while self.stack[-1].tag != tag:
+            self.add_child(self.stack.pop())
+        self.add_child(self.stack.pop())
+
+    def add_child(self, element: Element) -> None:
+        if element.tag != "br":
+            self.stack[-1].last_child = element
+
+    def handle_comment(self, data: str) -> None:
+        parent: Element = self.stack[-1]
+        target: Element = parent.last_child or parent
+        match: Optional[re.Match] = \
+            re.search(ELEMENT_ATTRIBUTES, data, re.MULTILINE)
+        if not match:
+            target = self.slide
+            match = re.search(SLIDE_ATTRIBUTES, data, re.MULTILINE)
+        if match:
+            target.attributes.update(parse_attributes(match.group(1)))
+            target.changed = True
+
+    def result(self) -> str:
+        self.feed(self.text)
+        self.close()
+        parts: List[str] = []
+        position: int = 0
+        element: Element
+        for element in self.elements:
+            if element.changed:
+                parts.append(self.text[position:element.span[0]])
+                parts.append(start_tag(element.tag, element.attributes))
+                position = element.span[1]
+        parts.append(self.text[position:])
+        return "".join(parts)
+
+
+def start_tag(tag: str, attributes: Attributes) -> str:
+    text: str = "<" + tag
+    name: str
+    value: Optional[str]
+    for name, value in attributes.items():
+        if value:
+            text += f" {name}=\"{html.escape(value)}\""
+        else:
+            text += " " + name
+    return text + ">"
+
+
+# Strip the indentation of the first line from all lines, like
+# getMarkdownFromSlide in the plugin
+def normalize_indentation(text: str) -> str:
+    leading_whitespace: int = len(re.match(r"^\n?(\s*)", text).group(1))
+    leading_tabs: int = len(re.match(r"^\n?(\t*)", text).group(1))
+    if leading_tabs > 0:
+        return re.sub("\n?\t{" + str(leading_tabs) + "}", "\n", text)
+    if leading_whitespace > 1:
+        return re.sub("\n? {" + str(leading_whitespace) + "}", "\n", text)
+    return text
+
+
+def render_slide(text: str) -> str:
+    notes: List[str] = re.split(NOTES_SEPARATOR, text,
+                                flags=re.MULTILINE | re.IGNORECASE)
+    notes_html: str = ""
+    if len(notes) == 2:
+        text = notes[0]
+        notes_html = \
+            "<aside class=\"notes\">" + to_html(notes[1].strip()) + "</aside>"
+    slide: Element = Element("section", {}, (0, 0))
+    content: str = \
+        AttributeParser(to_html(normalize_indentation(text)), slide).result()
+    return start_tag("section", slide.attributes) + content + notes_html + \
+        "</section>\n"
+
+
+def slidify(text: str) -> str:
+    separator: re.Pattern = re.compile(
+        HORIZONTAL_SEPARATOR + "|" + VERTICAL_SEPARATOR, re.MULTILINE)
+    # Horizontal slides, vertical stacks are lists of slides
+    stack: List[Union[str, List[str]]] = []
+    last_index: int = 0
+    was_horizontal: bool = True
+    match: re.Match
+    for match in separator.finditer(text):
+        is_horizontal: bool = \
+            re.search(HORIZONTAL_SEPARATOR, match.group(0)) is not None
+        if not is_horizontal and was_horizontal:
+            stack.append([])
+        content: str = text[last_index:match.start()]
+        if is_horizontal and was_horizontal:
+            stack.append(content)
+        else:
+            stack[-1].append(content)
+        last_index = match.end()
+        was_horizontal = is_horizontal
+    (stack if was_horizontal else stack[-1]).append(text[last_index:])
+
+    sections: List[str] = []
+    slide: Union[str, List[str]]
+    for slide in stack:
+        if isinstance(slide, list):
+            sections.append("<section>\n" +
+                            "".join(render_slide(x) for x in slide) +
+                            "</section>\n")
+        else:
+            sections.append(render_slide(slide))
+    return "".join(sections)
+
+
+def prerender(text: str) -> str:
+    digest: str = hashlib.sha1(text.encode()).hexdigest()
+    with CACHE_LOCK:
+        if digest in CACHE:
+            return CACHE[digest]
+    rendered: str = slidify(text)
+    with CACHE_LOCK:
+        if len(CACHE) >= CACHE_SIZE:
+            # Forget the oldest entry
+            del CACHE[next(iter(CACHE))]
+        CACHE[digest] = rendered
+    return rendered
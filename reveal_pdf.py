@@ -0,0 +1,399 @@
+#!/usr/bin/env python3
+
+# Exports a presentation to PDF the way reveal.js prints it with ?print-pdf,
+# in a headless Chrome, Chromium or Edge that loads the slides from the
+# built-in server. Every slide is printed on its own, in several browser
+# tabs at once, and kept in the user cache folder by a hash of its page, so
+# exporting again after an edit only prints the slides that changed. The
+# slides are merged with pypdf; without it, the whole deck is printed at
+# once.
+
+import asyncio
+import base64
+import hashlib
+import json
+import os
+import platform
+import re
+import shutil
+import socket
+import subprocess
+import tempfile
+import time
+
+from reveal_assets import cache_directory
+from reveal_cli import SlideCache, index_settings, load_template
+from reveal_server import Server
+from tornado import websocket
+from typing import Any, Dict, List, Optional, Tuple
+
+try:
+    import pypdf
+except ImportError:
+    pypdf = None
+
+
+PDF_WORKERS: int = 4
+# Seconds to wait for the browser to start, and for a slide to be printed
+BROWSER_TIMEOUT: float = 30.
+PRINT_TIMEOUT: float = 60.
+# Bump to invalidate the cache when the way slides are printed changes
+CACHE_VERSION: str = "1"
+# URL prefix the server mounts the pages to print at
+PAGES_MOUNT: str = "_pdf"
+# Printed slides that were not used for this many days are removed after
+# an export, so the cache does not keep every version of every slide
+PDF_CACHE_DAYS: int = 30
+
+BROWSER_NAMES: List[str] = ["google-chrome", "google-chrome-stable",
+                            "chromium", "chromium-browser", "chrome",
+                            "microsoft-edge", "msedge"]
+BROWSER_PATHS: Dict[str, List[str]] = {
+    "Darwin": ["/Applications/Google Chrome.app/Contents/MacOS/Google Chrome",
+               "/Applications/Chromium.app/Contents/MacOS/Chromium",
+               "/Applications/Microsoft Edge.app/Contents/MacOS/"
+               "Microsoft Edge"],
+    "Windows": [os.path.join(os.environ.get(x, ""), *y) for x, y in [
+        ("PROGRAMFILES", ["Google", "Chrome", "Application", "chrome.exe"]),
+        ("PROGRAMFILES(X86)", ["Google", "Chrome", "Application",
+                               "chrome.exe"]),
+        ("LOCALAPPDATA", ["Google", "Chrome", "Application", "chrome.exe"]),
+        ("PROGRAMFILES(X86)", ["Microsoft", "Edge", "Application",
+                               "msedge.exe"])]]}
+PRINT_OPTIONS: Dict[str, Any] = {"printBackground": True,
+                                 "preferCSSPageSize": True,
+                                 "marginTop": 0, "marginBottom": 0,
+                                 "marginLeft": 0, "marginRight": 0}
+# Resolves once reveal.js has laid out the slides as pages, and the fonts
+# they use are loaded
+PRINT_READY: str = """new Promise(function(resolve) {
+  function ready() { document.fonts.ready.then(resolve); }
+  if (document.querySelector(".pdf-page")) ready();
+  else Reveal.on("pdf-ready", ready);
+}).then(function() { return true; })"""
+
+HTML_SECTION: re.Pattern = re.compile(r"<section\b|</section\s*>",
+                                      re.IGNORECASE)
+HTML_HEAD: re.Pattern = re.compile(r"<head\b[^>]*>", re.IGNORECASE)
+HTML_REFERENCE: re.Pattern = re.compile(
+    r"\s(?:src|href|poster|data-[\w-]+)=([\"'])([^\"'<>:]+)\1")
+
+
+def find_browser(browser: Optional[str] = None) -> Optional[str]:
+    if browser:
+        return shutil.which(browser) or \
+            (browser if os.path.isfile(browser) else None)
+    name: str
+    for name in BROWSER_NAMES:
+        found: Optional[str] = shutil.which(name)
+        if found:
+            return found
+    return next((x for x in BROWSER_PATHS.get(platform.system(), [])
+                 if os.path.isfile(x)), None)
+
+
+# The top level <section> elements in `html`, in order
+def split_slides(html: str) -> List[str]:
+    slides: List[str] = []
+    depth: int = 0
+    start: int = 0
+    match: re.Match
+    for match in HTML_SECTION.finditer(html):
+        if match.group(0).startswith("</"):
+            depth -= 1
+            if depth == 0:
+                slides.append(html[start:match.end()])
+        else:
+            if depth == 0:
+                start = match.start()
+            depth += 1
+    return slides
+
+
+def free_port() -> int:
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+# Hash of a page and of the files it refers to, by modification time and
+# size, since a new image changes the slide as well
+def page_digest(page: str, path: str) -> str:
+    hasher = hashlib.sha256(f"{CACHE_VERSION}\0".encode() +
+                            json.dumps(PRINT_OPTIONS).encode() +
+                            page.encode())
+    url: str
+    for url in sorted({x.group(2) for x in HTML_REFERENCE.finditer(page)}):
+        try:
+            stat: os.stat_result = os.stat(
+                os.path.join(path, re.split(r"[?#]", url)[0]))
+        except (OSError, ValueError):
+            continue
+        hasher.update(f"\0{url}\0{stat.st_mtime_ns}\0{stat.st_size}"
+                      .encode())
+    return hasher.hexdigest()
+
+
+# A connection to the DevTools protocol of the browser, with one session per
+# tab. Commands wait for their result; events are kept until waited for.
+class DevTools:
+    def __init__(self, connection: websocket.WebSocketClientConnection) \
+            -> None:
+        self.connection: websocket.WebSocketClientConnection = connection
+        self.next_id: int = 0
+        self.results: Dict[int, asyncio.Future] = {}
+        self.events: Dict[Tuple[Optional[str], str], asyncio.Future] = {}
+        self.reader: asyncio.Task = asyncio.ensure_future(self.read())
+
+    @classmethod
+    async def connect(cls, url: str) -> "DevTools":
+        # Printed slides come back in a single message
+        return cls(await websocket.websocket_connect(
+            url, max_message_size=1024 * 2**20))
+
+    async def read(self) -> None:
+        while True:
+            message: Optional[str] = await self.connection.read_message()
+            if message is None:
+                error: ConnectionError = \
+                    ConnectionError("the browser closed the connection")
+                future: asyncio.Future
+                for future in list(self.results.values()) + \
+                        list(self.events.values()):
+                    if not future.done():
+                        future.set_exception(error)
+                return
+            data: Dict[str, Any] = json.loads(message)
+            if "id" in data:
+                future = self.results.pop(data["id"], None)
+                if future is None:
+                    continue
+                if "error" in data:
+                    future.set_exception(
+                        RuntimeError(data["error"].get("message")))
+                else:
+                    future.set_result(data.get("result", {}))
+            else:
+                key: Tuple[Optional[str], str] = \
+                    (data.get("sessionId"), data.get("method", ""))
+                if key in self.events and not self.events[key].done():
+                    self.events[key].set_result(data.get("params", {}))
+
+    async def call(self, method: str, session: Optional[str] = None,
+                   **params: Any) -> Dict[str, Any]:
+        self.next_id += 1
+        message: Dict[str, Any] = {"id": self.next_id, "method": method,
+                                   "params": params}
+        if session is not None:
+            message["sessionId"] = session
+        future: asyncio.Future = asyncio.get_running_loop().create_future()
+        self.results[self.next_id] = future
+        await self.connection.write_message(json.dumps(message))
+        return await future
+
+    # Call before the command that causes the event, then await the result
+    def expect(self, method: str, session: Optional[str] = None) \
+            -> asyncio.Future:
+        future: asyncio.Future = asyncio.get_running_loop().create_future()
+        self.events[(session, method)] = future
+        return future
+
+    def close(self) -> None:
+        self.reader.cancel()
+        self.connection.close()
+
+
+# A page to print: its URL, the file to print it to, and what to call it
+PrintJob = Tuple[str, str, str]
+
+
+# Prints the pages of `jobs` in `workers` tabs at once. Raises RuntimeError
+# if the browser is too slow or goes away.
+async def print_pages(devtools_url: str, jobs: List[PrintJob],
+                      workers: int) -> None:
+    try:
+        devtools: DevTools = await DevTools.connect(devtools_url)
+    except (OSError, websocket.WebSocketError) as e:
+        raise RuntimeError(f"cannot connect to the browser: {e}") from e
+    queue: "asyncio.Queue[PrintJob]" = asyncio.Queue()
+    job: PrintJob
+    for job in jobs:
+        queue.put_nowait(job)
+
+    async def work() -> None:
+        target: Dict[str, Any] = \
+            await devtools.call("Target.createTarget", url="about:blank")
+        session: str = (await devtools.call(
+            "Target.attachToTarget", targetId=target["targetId"],
+            flatten=True))["sessionId"]
+        await devtools.call("Page.enable", session)
+        while not queue.empty():
+            url, output, name = queue.get_nowait()
+            loaded: asyncio.Future = \
+                devtools.expect("Page.loadEventFired", session)
+            try:
+                await devtools.call("Page.navigate", session, url=url)
+                await asyncio.wait_for(loaded, PRINT_TIMEOUT)
+                await asyncio.wait_for(devtools.call(
+                    "Runtime.evaluate", session, expression=PRINT_READY,
+                    awaitPromise=True), PRINT_TIMEOUT)
+                printed: Dict[str, Any] = await asyncio.wait_for(
+                    devtools.call("Page.printToPDF", session,
+                                  **PRINT_OPTIONS), PRINT_TIMEOUT)
+            except asyncio.TimeoutError as e:
+                raise RuntimeError(f"{name} did not print within "
+                                   f"{PRINT_TIMEOUT} s") from e
+            write_bytes(output, base64.b64decode(printed["data"]))
+            print("Printed " + name)
+        await devtools.call("Target.closeTarget",
+                            targetId=target["targetId"])
+
+    try:
+        await asyncio.gather(*[work() for _ in range(min(workers,
+                                                         len(jobs)))])
+    except (OSError, websocket.WebSocketError) as e:
+        # ConnectionError from DevTools.read is an OSError too
+        raise RuntimeError(f"lost the browser: {e}") from e
+    finally:
+        devtools.close()
+
+
+def write_bytes(file: str, content: bytes) -> None:
+    descriptor, temporary = tempfile.mkstemp(dir=os.path.dirname(file))
+    with os.fdopen(descriptor, "wb") as f:
+        f.write(content)
+    os.replace(temporary, file)
+
+
+# Starts the browser with a DevTools port and returns it with the URL of
+# its DevTools connection
+def start_browser(browser: str, profile: str) \
+        -> Tuple[subprocess.Popen, str]:
+    try:
+        process: subprocess.Popen = subprocess.Popen(
+            [browser, "--headless=new", "--disable-gpu", "--no-first-run",
+             "--no-default-browser-check", "--hide-scrollbars",
+             "--remote-debugging-port=0", "--user-data-dir=" + profile,
+             "about:blank"],
+            stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    except OSError as e:
+        raise RuntimeError(f"cannot start {browser}: {e}") from e
+    # The browser writes its port and path there once it listens
+    port_file: str = os.path.join(profile, "DevToolsActivePort")
+    deadline: float = time.monotonic() + BROWSER_TIMEOUT
+    while time.monotonic() < deadline and process.poll() is None:
+        try:
+            with open(port_file) as f:
+                lines: List[str] = f.read().split()
+            if len(lines) >= 2:
+                return process, f"ws://127.0.0.1:{lines[0]}{lines[1]}"
+        except OSError:
+            pass
+        time.sleep(0.05)
+    process.kill()
+    raise RuntimeError(f"{browser} did not start")
+
+
+# Removes the printed slides in `cache` that were not used for `days` days
+def prune_cache(cache: str, days: int = PDF_CACHE_DAYS) -> None:
+    oldest: float = time.time() - days * 24 * 60 * 60
+    name: str
+    for name in os.listdir(cache):
+        file: str = os.path.join(cache, name)
+        try:
+            if name.endswith(".pdf") and os.path.getmtime(file) < oldest:
+                os.remove(file)
+        except OSError:
+            pass
+
+
+# Renders `path` and prints it to the PDF file `output`. `mounts` are served
+# next to the presentation, like the reveal.js mount.
+def export_pdf(path: str, template_name: str, output: str,
+               reveal_specs: Optional[Dict[str, Dict[str, List[str]]]] = None,
+               mounts: Optional[Dict[str, str]] = None,
+               browser: Optional[str] = None, workers: int = PDF_WORKERS,
+               use_cache: bool = True) -> None:
+    browser_path: Optional[str] = find_browser(browser)
+    if browser_path is None:
+        raise RuntimeError(browser or "no Chrome, Chromium or Edge found")
+
+    # Prerendered, so that every slide is a <section> of its own, and a
+    # page that only holds that slide
+    slide_cache: SlideCache = SlideCache(path, True, True)
+    slide_cache.sync()
+    settings: Dict[str, str] = index_settings(slide_cache, reveal_specs)
+    template = load_template(template_name)
+    slides: List[str] = split_slides(slide_cache.slides())
+    if pypdf is None:
+        print("pypdf is not installed, printing all slides at once")
+        slides = ["".join(slides)]
+    # Pages are served from a mount; their URLs are relative to the
+    # presentation folder
+    pages: List[str] = [HTML_HEAD.sub(lambda x: x.group(0) +
+                                      "<base href=\"/\">",
+                                      template.render({**settings,
+                                                       "slides": x}), 1)
+                        for x in slides]
+    digests: List[str] = [page_digest(x, path) for x in pages]
+
+    cache: str = cache_directory("pdf") if use_cache \
+        else tempfile.mkdtemp(prefix="reveal-pdf-")
+    os.makedirs(cache, exist_ok=True)
+    printed: List[str] = [os.path.join(cache, x + ".pdf") for x in digests]
+    missing: List[int] = [i for i, x in enumerate(printed)
+                          if not os.path.isfile(x)]
+    print(f"{len(slides)} slides, {len(slides) - len(missing)} unchanged")
+    # Marks the reused slides as used, see prune_cache()
+    for i in set(range(len(printed))) - set(missing):
+        os.utime(printed[i])
+
+    staging: str = tempfile.mkdtemp(prefix="reveal-pdf-")
+    try:
+        if missing:
+            i: int
+            for i in missing:
+                with open(os.path.join(staging, digests[i] + ".html"), "w",
+                          encoding="utf-8") as f:
+                    f.write(pages[i])
+            server: Server = Server(caching=False, compression=False,
+                                    mounts={**(mounts or {}),
+                                            PAGES_MOUNT: staging})
+            port: int = free_port()
+            server.start(port, path)
+            process: Optional[subprocess.Popen] = None
+            try:
+                process, devtools_url = start_browser(
+                    browser_path, os.path.join(staging, "profile"))
+                asyncio.run(print_pages(
+                    devtools_url,
+                    [(f"http://127.0.0.1:{port}/{PAGES_MOUNT}/{digests[i]}"
+                      f".html?print-pdf", printed[i], f"slide {i + 1}")
+                     for i in missing], workers))
+            finally:
+                if process is not None:
+                    process.terminate()
+                    try:
+                        process.wait(5)
+                    except subprocess.TimeoutExpired:
+                        process.kill()
+                server.stop()
+
+        os.makedirs(os.path.dirname(os.path.abspath(output)), exist_ok=True)
+        if pypdf is None:
+            shutil.copyfile(printed[0], output)
+        else:
+            writer: pypdf.PdfWriter = pypdf.PdfWriter()
+            file: str
+            for file in printed:
+                writer.append(file)
+            temporary: str = os.path.join(staging, "merged.pdf")
+            with open(temporary, "wb") as f:
+                writer.write(f)
+            shutil.move(temporary, output)
+        if use_cache:
+            prune_cache(cache)
+    finally:
+        shutil.rmtree(staging, ignore_errors=True)
+        if not use_cache:
+            shutil.rmtree(cache, ignore_errors=True)
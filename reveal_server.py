@@ -0,0 +1,504 @@
+#!/usr/bin/env python3
+
+import asyncio
+import gzip
+import hashlib
+import html
+import livereload
+import os
+import re
+import threading
+import urllib.error
+import urllib.parse
+import urllib.request
+
+from livereload.handlers import ForceReloadHandler, LiveReloadHandler, \
+    LiveReloadJSHandler
+from livereload.server import LiveScriptInjector
+from livereload.watcher import Watcher
+from tornado import escape, ioloop, web
+from typing import Dict, FrozenSet, List, Optional, Tuple
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+
+# Versioned reveal.js files and image variants, which are named by content
+# hash, never change, so browsers may keep them. All other files are
+# revalidated with their ETag on every request.
+IMMUTABLE_PATH: re.Pattern = re.compile(r"^(reveal\.js/\d+(\.\d+)*|_images)/")
+IMMUTABLE_CACHE_CONTROL: str = "public, max-age=31536000, immutable"
+
+# Files smaller than this are not worth compressing
+COMPRESSION_MIN_SIZE: int = 512
+# Upper limit for all compressed files kept in memory together, in bytes
+COMPRESSION_CACHE_SIZE: int = 64 * 2**20
+COMPRESSIBLE_TYPES: List[str] = ["application/javascript",
+                                 "application/json",
+                                 "application/x-javascript",
+                                 "application/xml",
+                                 "image/svg+xml"]
+HEAD_END: bytes = b"</head>"
+
+# The snippet livereload injects into HTML pages to load livereload.js
+LIVE_SCRIPT: bytes = escape.utf8(
+    "<script type=\"text/javascript\">(function(){"
+    "var s=document.createElement(\"script\");"
+    "var port=(window.location.port || "
+    "(window.location.protocol == 'https:' ? 443: 80));"
+    "s.src=\"//\"+window.location.hostname+\":\"+port"
+    "+ \"/livereload.js?port=\" + port;"
+    "document.head.appendChild(s);"
+    "})();</script>")
+
+
+# Without any watch tasks, livereload falls back to polling the whole current
+# directory. This watcher never polls; reloads are pushed by the refresh
+# pipeline through a ReloadNotifier instead.
+class NotifyWatcher(Watcher):
+    def watch(self, path, func=None, delay=0, ignore=None):
+        pass
+
+    def start(self, callback):
+        # True tells livereload not to start its own polling loop
+        return True
+
+    def examine(self):
+        return None, None
+
+
+# Serves files with strong ETags, answers 304 Not Modified when the browser
+# already has the file, and sets Cache-Control per path. Unlike the
+# livereload handler, which never answers 304, a reload only fetches
+# index.html and the files that actually changed.
+class CachingStaticFileHandler(web.StaticFileHandler):
+    # ETags by absolute path, with the mtime and size they were computed for
+    etags: Dict[str, Tuple[int, int, str]] = {}
+    etags_lock: threading.Lock = threading.Lock()
+
+    def initialize(self, path: str, default_filename: Optional[str] = None,
+                   url_prefix: str = "",
+                   files: Optional[FrozenSet[str]] = None) -> None:
+        super().initialize(path, default_filename)
+        # Where `path` is mounted in the URL space, for example "reveal.js/"
+        self.url_prefix: str = url_prefix
+        # The only files served from `path`, relative to it, or None for all
+        self.files: Optional[FrozenSet[str]] = files
+
+    def url_path(self) -> str:
+        return self.url_prefix + self.path.replace(os.sep, "/")
+
+    def validate_absolute_path(self, root: str,
+                               absolute_path: str) -> Optional[str]:
+        absolute_path = super().validate_absolute_path(root, absolute_path)
+        if absolute_path is not None and self.files is not None \
+                and os.path.relpath(absolute_path, self.root) \
+                not in self.files:
+            raise web.HTTPError(404)
+        return absolute_path
+
+    def compute_etag(self) -> Optional[str]:
+        stat: os.stat_result = os.stat(self.absolute_path)
+        with self.etags_lock:
+            cached: Optional[Tuple[int, int, str]] = \
+                self.etags.get(self.absolute_path)
+        if cached is not None \
+                and cached[:2] == (stat.st_mtime_ns, stat.st_size):
+            return cached[2]
+        hasher = hashlib.sha1()
+        with open(self.absolute_path, "rb") as f:
+            for chunk in iter(lambda: f.read(2**16), b""):
+                hasher.update(chunk)
+        etag: str = "\"" + hasher.hexdigest() + "\""
+        with self.etags_lock:
+            self.etags[self.absolute_path] = \
+                (stat.st_mtime_ns, stat.st_size, etag)
+        return etag
+
+    def set_extra_headers(self, path: str) -> None:
+        if IMMUTABLE_PATH.match(self.url_path()):
+            self.set_header("Cache-Control", IMMUTABLE_CACHE_CONTROL)
+        else:
+            self.set_header("Cache-Control", "no-cache")
+
+
+# Compresses text files with brotli (if the brotli package is installed) or
+# gzip, depending on what the browser accepts. Compressed files are kept in
+# memory by ETag, so every version of a file is only compressed once.
+class CompressingStaticFileHandler(CachingStaticFileHandler):
+    # Compressed content by ETag and encoding, oldest first
+    compressed: Dict[Tuple[str, str], bytes] = {}
+    compressed_size: int = 0
+    compressed_lock: threading.Lock = threading.Lock()
+
+    def initialize(self, path: str, default_filename: Optional[str] = None,
+                   url_prefix: str = "",
+                   files: Optional[FrozenSet[str]] = None,
+                   live_script: bytes = b"") -> None:
+        super().initialize(path, default_filename, url_prefix, files)
+        # livereload injects its script into uncompressed pages only, so
+        # compressed pages get it here.
+        self.live_script: bytes = live_script
+
+    def accepted_encoding(self) -> Optional[str]:
+        accepted: Dict[str, float] = {}
+        part: str
+        for part in self.request.headers.get("Accept-Encoding", "").split(","):
+            name, _, parameters = part.strip().partition(";")
+            quality: float = 1.
+            if parameters.strip().startswith("q="):
+                try:
+                    quality = float(parameters.strip()[2:])
+                except ValueError:
+                    quality = 0.
+            accepted[name.strip().lower()] = quality
+        if brotli is not None and accepted.get("br", 0.) > 0.:
+            return "br"
+        if accepted.get("gzip", 0.) > 0.:
+            return "gzip"
+        return None
+
+    def compressible(self) -> bool:
+        content_type: str = self.get_content_type().split(";")[0]
+        return (content_type.startswith("text/")
+                or content_type in COMPRESSIBLE_TYPES) \
+            and os.path.getsize(self.absolute_path) >= COMPRESSION_MIN_SIZE
+
+    def compress(self, etag: str, encoding: str) -> bytes:
+        with self.compressed_lock:
+            content: Optional[bytes] = self.compressed.get((etag, encoding))
+        if content is not None:
+            return content
+
+        with open(self.absolute_path, "rb") as f:
+            content = f.read()
+        immutable: bool = IMMUTABLE_PATH.match(self.url_path()) is not None
+        if "html" in self.get_content_type():
+            content = content.replace(HEAD_END, self.live_script + HEAD_END, 1)
+        # Spend more time on files that never change
+        if encoding == "br":
+            content = brotli.compress(content, quality=11 if immutable else 5)
+        else:
+            content = gzip.compress(content, 9 if immutable else 6)
+
+        cls = CompressingStaticFileHandler
+        with self.compressed_lock:
+            if (etag, encoding) not in cls.compressed:
+                cls.compressed[(etag, encoding)] = content
+                cls.compressed_size += len(content)
+            while cls.compressed_size > COMPRESSION_CACHE_SIZE:
+                oldest: Tuple[str, str] = next(iter(cls.compressed))
+                cls.compressed_size -= len(cls.compressed.pop(oldest))
+        return content
+
+    async def get(self, path: str, include_body: bool = True) -> None:
+        encoding: Optional[str] = self.accepted_encoding()
+        if encoding is None or "Range" in self.request.headers:
+            return await super().get(path, include_body)
+
+        # Same path handling as the base class
+        self.path = self.parse_url_path(path)
+        self.absolute_path = self.validate_absolute_path(
+            self.root, self.get_absolute_path(self.root, self.path))
+        if self.absolute_path is None:
+            return
+        if not self.compressible():
+            return await super().get(path, include_body)
+
+        etag: str = self.compute_etag()
+        self.set_header("Etag", etag[:-1] + "-" + encoding + "\"")
+        self.set_header("Vary", "Accept-Encoding")
+        self.set_header("Content-Type", self.get_content_type())
+        self.set_extra_headers(self.path)
+        if self.check_etag_header():
+            self.set_status(304)
+            return
+
+        content: bytes = self.compress(etag, encoding)
+        self.set_header("Content-Encoding", encoding)
+        if include_body:
+            self.write(content)
+        else:
+            self.set_header("Content-Length", len(content))
+
+
+# Remembers which page each browser connection belongs to, so that a change
+# in one deck only reloads the browsers showing that deck.
+class DeckLiveReloadHandler(LiveReloadHandler):
+    page_path: str = ""
+
+    def on_message(self, message):
+        super().on_message(message)
+        data = escape.json_decode(message)
+        if data.get("command") == "info" and "url" in data:
+            self.page_path = urllib.parse.urlparse(data["url"]).path
+
+    @classmethod
+    def reload_deck(cls, path, deck):
+        message = {"command": "reload",
+                   "path": path,
+                   "liveCSS": cls.live_css,
+                   "liveImg": True}
+        for waiter in LiveReloadHandler.waiters.copy():
+            # Deck names may have characters that are percent-encoded in
+            # the URL
+            if not urllib.parse.unquote(
+                    getattr(waiter, "page_path", "")).startswith(
+                        "/" + deck + "/"):
+                continue
+            try:
+                waiter.write_message(message)
+            except Exception:
+                LiveReloadHandler.waiters.discard(waiter)
+
+
+# Serves the files of the deck named by the first part of the URL. The decks
+# are looked up on every request, so they can change while serving.
+class DeckFileMixin:
+    def initialize(self, decks, **options):
+        self.decks = decks
+        super().initialize(path=".", **options)
+
+    async def get(self, deck, path, include_body=True):
+        root = self.decks.get(deck)
+        if root is None:
+            raise web.HTTPError(404)
+        self.root = root
+        return await super().get(path, include_body)
+
+    def head(self, deck, path):
+        return self.get(deck, path, include_body=False)
+
+
+# Serves a mount, unless the presentation folder has its own folder of that
+# name, for example a reveal.js with its own custom_css or plugins, which
+# then wins over the mount. `folder` returns the presentation folder, by
+# deck name when the server hosts several decks.
+class MountFileMixin:
+    def initialize(self, folder, prefix, **options):
+        self.folder = folder
+        self.prefix = prefix
+        super().initialize(**options)
+
+    async def get(self, *args, include_body=True):
+        *deck, path = args
+        root = self.folder(*deck)
+        own = None if root is None else os.path.join(root, self.prefix)
+        if own is not None and os.path.isdir(own):
+            self.root = own
+            # The own folder is served completely
+            self.files = None
+        return await super().get(path, include_body)
+
+    def head(self, *args):
+        return self.get(*args, include_body=False)
+
+
+# Lists the decks on "/", and adds the trailing slash to "/<deck>", so that
+# relative links in the deck work.
+class DeckIndexHandler(web.RequestHandler):
+    def initialize(self, decks):
+        self.decks = decks
+
+    def get(self, deck=None):
+        if deck is not None:
+            if deck not in self.decks:
+                raise web.HTTPError(404)
+            self.redirect("/" + urllib.parse.quote(deck) + "/")
+            return
+        links = "".join(
+            f"<li><a href=\"{urllib.parse.quote(name)}/\">"
+            f"{html.escape(name)}</a></li>" for name in sorted(self.decks))
+        self.write("<!DOCTYPE html><html><head><title>Presentations</title>"
+                   f"</head><body><ul>{links}</ul></body></html>")
+
+
+# `mounts` maps URL prefixes to folders served in their place, for example
+# {"reveal.js": <shared reveal.js folder>}, so presentation folders do not
+# need their own copy. `mount_files` optionally limits a mount to the listed
+# files, relative to its folder.
+#
+# With `decks`, a dictionary of names to presentation folders, the server
+# hosts all of them, each under /<name>/, instead of a single root folder.
+# Mounts then apply inside every deck. Decks can be added and removed while
+# serving.
+class Server(livereload.Server):
+    def __init__(self, app=None, caching=True, compression=True,
+                 mounts=None, mount_files=None, decks=None):
+        super().__init__(app=app, watcher=NotifyWatcher())
+        if compression:
+            self.SFH = CompressingStaticFileHandler
+        elif caching:
+            self.SFH = CachingStaticFileHandler
+        self.mounts = mounts or {}
+        self.mount_files = mount_files or {}
+        self.decks = decks
+        # The IOLoop and thread of start() or serve(), while serving
+        self.loop = None
+        self.thread = None
+
+    def get_web_handlers(self, script):
+        handlers = super().get_web_handlers(script)
+        if self.app:
+            return handlers
+        if self.SFH is CompressingStaticFileHandler:
+            handlers[0][2]["live_script"] = script
+        deck_prefix = ""
+        if self.decks is not None:
+            options = {"decks": self.decks,
+                       "default_filename": self.default_filename}
+            if self.SFH is CompressingStaticFileHandler:
+                options["live_script"] = script
+            handler = type("DeckFileHandler", (DeckFileMixin, self.SFH), {})
+            handlers = [(r"/", DeckIndexHandler, {"decks": self.decks}),
+                        (r"/([^/]+)", DeckIndexHandler, {"decks": self.decks}),
+                        (r"/([^/]+)/(.*)", handler, options)]
+            deck_prefix = r"/([^/]+)"
+        for prefix, directory in self.mounts.items():
+            options = {"path": directory, "folder": self.deck_folder,
+                       "prefix": prefix}
+            if issubclass(self.SFH, CachingStaticFileHandler):
+                options["url_prefix"] = prefix + "/"
+                if prefix in self.mount_files:
+                    options["files"] = frozenset(self.mount_files[prefix])
+            if self.SFH is CompressingStaticFileHandler:
+                options["live_script"] = script
+            handler = type("MountFileHandler", (MountFileMixin, self.SFH),
+                           {})
+            handlers.insert(0, (deck_prefix + r"/" + re.escape(prefix) +
+                                r"/(.*)", handler, options))
+        return handlers
+
+    def deck_folder(self, deck=None):
+        return self.root if self.decks is None else self.decks.get(deck)
+
+    # Like livereload's, but with a reload handler that knows the deck of
+    # each browser
+    def application(self, port, host, liveport=None, debug=None,
+                    live_css=True):
+        if self.decks is None or self.app or liveport:
+            return super().application(port, host, liveport, debug,
+                                       live_css)
+        LiveReloadHandler.watcher = self.watcher
+        LiveReloadHandler.live_css = live_css
+
+        class ConfiguredTransform(LiveScriptInjector):
+            script = LIVE_SCRIPT
+
+        app = web.Application(
+            handlers=[(r"/livereload", DeckLiveReloadHandler),
+                      (r"/forcereload", ForceReloadHandler),
+                      (r"/livereload.js", LiveReloadJSHandler)] +
+            self.get_web_handlers(LIVE_SCRIPT),
+            debug=bool(debug),
+            transforms=[ConfiguredTransform])
+        app.listen(port, address=host)
+
+    # Like livereload's, and calls `ready` once the port is bound and the
+    # IOLoop runs
+    def serve(self, *args, ready=None, **kwargs):
+        self.loop = ioloop.IOLoop.current()
+        if ready is not None:
+            self.loop.add_callback(ready)
+        try:
+            super().serve(*args, **kwargs)
+        finally:
+            self.loop = None
+
+    def add_deck(self, name, path):
+        self.decks[name] = path
+
+    def remove_deck(self, name):
+        self.decks.pop(name, None)
+
+    # Serves in this process, on a thread with its own IOLoop, unlike
+    # serve(), which blocks. Returns once the port is bound, and raises
+    # OSError if it cannot be, for example because the port is in use.
+    def start(self, port, root=None, host="127.0.0.1"):
+        if self.running():
+            self.stop()
+        started = threading.Event()
+        errors = []
+
+        def run():
+            asyncio.set_event_loop(asyncio.new_event_loop())
+            loop = ioloop.IOLoop.current()
+            try:
+                if root is not None:
+                    self.root = root
+                self.default_filename = "index.html"
+                self.application(port, host)
+                LiveReloadHandler.start_tasks()
+            except OSError as e:
+                errors.append(e)
+                loop.close(all_fds=True)
+                started.set()
+                return
+            self.loop = loop
+            started.set()
+            loop.start()
+            # Also closes the listening sockets, so the port is free again
+            loop.close(all_fds=True)
+
+        self.thread = threading.Thread(target=run, daemon=True)
+        self.thread.start()
+        started.wait()
+        if errors:
+            self.thread.join()
+            self.thread = None
+            raise errors[0]
+        print(f"Serving on http://{host}:{port}")
+
+    def running(self):
+        return self.thread is not None and self.thread.is_alive()
+
+    def stop(self):
+        if not self.running():
+            return
+
+        def shutdown():
+            for waiter in list(LiveReloadHandler.waiters):
+                waiter.close()
+            LiveReloadHandler.waiters.clear()
+            self.loop.stop()
+
+        self.loop.add_callback(shutdown)
+        self.thread.join()
+        self.loop = None
+        self.thread = None
+
+    def restart(self, port, root=None, host="127.0.0.1"):
+        self.stop()
+        self.start(port, root, host)
+
+    # Tells the connected browsers to reload `path`, like ReloadNotifier,
+    # but directly on the IOLoop. With `deck`, only the browsers showing
+    # that deck.
+    def notify(self, path, deck=None):
+        loop = self.loop
+        if loop is None:
+            return
+        if deck is None:
+            loop.add_callback(LiveReloadHandler.reload_waiters, path)
+        else:
+            loop.add_callback(DeckLiveReloadHandler.reload_deck, path, deck)
+
+
+# Tells the browsers connected to the server on `port` to reload `path`.
+# livereload.js reloads only the stylesheets for a .css path and only the
+# images for an image path, anything else reloads the page. This goes over
+# HTTP, so it also works if the server runs in another process.
+class ReloadNotifier:
+    def __init__(self, port: int, host: str = "127.0.0.1") -> None:
+        self.url: str = f"http://{host}:{port}/forcereload"
+
+    def __call__(self, path: str) -> None:
+        query: str = urllib.parse.urlencode({"path": path})
+        try:
+            with urllib.request.urlopen(self.url + "?" + query, timeout=1):
+                pass
+        except (urllib.error.URLError, OSError):
+            # Server not up (yet), nobody to notify
+            pass
@@ -0,0 +1,98 @@
+#!/usr/bin/env python3
+
+# Runs blocking work (disk I/O, starting and stopping the server) off the Tk
+# main thread. Results come back through a queue that the main loop polls
+# with after(), since Tk widgets may only be touched from the main thread.
+
+import concurrent.futures
+import queue
+import tkinter as tk
+import traceback
+
+from typing import Any, Callable, Optional, Tuple
+
+
+# How often the main loop checks for results, in milliseconds
+POLL_INTERVAL: int = 50
+WORKERS: int = 4
+
+# A call to make on the main thread: function and arguments
+Call = Tuple[Callable[..., None], Tuple[Any, ...]]
+
+
+class TaskRunner:
+    def __init__(self, widget: tk.Misc, workers: int = WORKERS,
+                 busy: Optional[Callable[[bool], None]] = None) -> None:
+        self.widget: tk.Misc = widget
+        # Independent tasks, like reading files
+        self.pool: concurrent.futures.ThreadPoolExecutor = \
+            concurrent.futures.ThreadPoolExecutor(workers)
+        # Tasks that must run one after the other, in the order submitted,
+        # like starting and stopping the server
+        self.serial: concurrent.futures.ThreadPoolExecutor = \
+            concurrent.futures.ThreadPoolExecutor(1)
+        self.calls: "queue.Queue[Call]" = queue.Queue()
+        # Called with True when the first task is submitted and with False
+        # when the last one is done
+        self.busy: Optional[Callable[[bool], None]] = busy
+        # Tasks without a result yet, and whether poll() is scheduled. Only
+        # used on the main thread.
+        self.pending: int = 0
+        self.polling: bool = False
+
+    # Runs `work(*args)` on a worker thread, then `done(result)` or
+    # `failed(exception)` on the main thread. Call from the main thread.
+    def submit(self, work: Callable[..., Any], *args: Any,
+               done: Optional[Callable[[Any], None]] = None,
+               failed: Optional[Callable[[Exception], None]] = None,
+               serial: bool = False) -> None:
+        self.pending += 1
+        if self.pending == 1 and self.busy is not None:
+            self.busy(True)
+        if not self.polling:
+            self.polling = True
+            self.widget.after(POLL_INTERVAL, self.poll)
+
+        def run() -> None:
+            try:
+                result: Any = work(*args)
+            except Exception as e:
+                traceback.print_exc()
+                self.post(self.finish, failed, e)
+            else:
+                self.post(self.finish, done, result)
+
+        (self.serial if serial else self.pool).submit(run)
+
+    # Calls `function(*args)` on the main thread, for example to show
+    # progress. Call from a worker thread.
+    def post(self, function: Callable[..., None], *args: Any) -> None:
+        self.calls.put((function, args))
+
+    def finish(self, callback: Optional[Callable[[Any], None]],
+               value: Any) -> None:
+        self.pending -= 1
+        if callback is not None:
+            callback(value)
+
+    def poll(self) -> None:
+        while True:
+            try:
+                function, args = self.calls.get_nowait()
+            except queue.Empty:
+                break
+            try:
+                function(*args)
+            except Exception:
+                traceback.print_exc()
+        if self.pending == 0:
+            self.polling = False
+            if self.busy is not None:
+                self.busy(False)
+        else:
+            self.widget.after(POLL_INTERVAL, self.poll)
+
+    # Waits for running tasks, drops the queued ones
+    def shutdown(self) -> None:
+        self.pool.shutdown(wait=True, cancel_futures=True)
+        self.serial.shutdown(wait=True, cancel_futures=True)
@@ -0,0 +1,88 @@
+#!/usr/bin/env python3
+
+# Measures how long the stages of starting up and of refreshing a deck take.
+# Off by default, when a stage costs one clock read. With --timings every
+# stage is printed, and with --trace also appended to a file as one JSON
+# object per line, with enough about the machine to compare traces from
+# several machines.
+
+import contextlib
+import json
+import os
+import platform
+import sys
+import threading
+import time
+
+from typing import Any, Dict, Iterable, Iterator, Optional
+
+from version import __version__
+
+
+class Timings:
+    def __init__(self) -> None:
+        self.enabled: bool = False
+        self.trace_file: Optional[str] = None
+        self.lock: threading.Lock = threading.Lock()
+        # Written with every record of the trace
+        self.machine: Dict[str, Any] = {}
+
+    def enable(self, trace_file: Optional[str] = None) -> None:
+        self.enabled = True
+        self.trace_file = trace_file
+        self.machine = {"host": platform.node(),
+                        "system": platform.system(),
+                        "python": platform.python_version(),
+                        "version": __version__,
+                        "pid": os.getpid()}
+
+    # Records `seconds` for `stage`, with `fields` describing it, such as
+    # the deck or the number of files
+    def record(self, stage: str, seconds: float, **fields: Any) -> None:
+        if not self.enabled:
+            return
+        details: str = ", ".join(f"{x}={y}" for x, y in fields.items())
+        print(f"timing {stage}: {seconds * 1000:.1f} ms" +
+              (f" ({details})" if details else ""))
+        if self.trace_file is None:
+            return
+        line: str = json.dumps({"time": time.time(), "stage": stage,
+                                "ms": round(seconds * 1000, 3),
+                                **fields, **self.machine})
+        with self.lock:
+            try:
+                with open(self.trace_file, "a", encoding="utf-8") as f:
+                    f.write(line + "\n")
+            except OSError as e:
+                print(f"cannot write the trace, not writing it anymore: {e}",
+                      file=sys.stderr)
+                self.trace_file = None
+
+    @contextlib.contextmanager
+    def stage(self, stage: str, **fields: Any) -> Iterator[None]:
+        start: float = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.record(stage, time.perf_counter() - start, **fields)
+
+    # Passes on `chunks` and records the time spent making them, which for
+    # a rendering generator is the rendering without the writing
+    def chunks(self, stage: str, chunks: Iterable[str],
+               **fields: Any) -> Iterator[str]:
+        spent: float = 0
+        iterator: Iterator[str] = iter(chunks)
+        while True:
+            start: float = time.perf_counter()
+            try:
+                chunk: str = next(iterator)
+            except StopIteration:
+                break
+            finally:
+                spent += time.perf_counter() - start
+            yield chunk
+        self.record(stage, spent, **fields)
+
+
+# Shared by the whole process, enabled by main() of reveal.py
+timings: Timings = Timings()